@@ -0,0 +1,92 @@
+"""
+Compares the old start_of_packet scan with the linear frame sync
+Run from repository root: python3 -m benchmarks.bench_frame_sync
+"""
+from benchmarks.common import load_hex_lines, measure, report
+from lib.victron_bluetooth.frame_sync import FrameSync, find_signature
+from lib.victron_bluetooth.reassembly_buffer import ReassemblyBuffer
+
+SIGNATURE = [
+    (1, (0x03, 0x00)),
+    (2, (0x19,)),
+]
+
+
+# Scan of VictronBluetooth before the frame sync
+def signature_complete(value, signature):
+    try:
+        for pos, sigs in signature:
+            if not value[pos] in sigs:
+                return False
+        return True
+    except:
+        return False
+
+
+def start_of_packet(value):
+    for offset, _ in enumerate(value):
+        result = signature_complete(value[offset:], SIGNATURE)
+        if result:
+            return offset
+    return -1
+
+
+def scan_capture_old(notifications):
+    buffer = bytearray()
+    for notification in notifications:
+        buffer.extend(notification)
+        pos = start_of_packet(buffer)
+        while pos >= 0:
+            # skip header and command, enough to get to the next value
+            buffer = buffer[pos + 4:]
+            pos = start_of_packet(buffer)
+
+
+def scan_capture_new(notifications):
+    buffer = ReassemblyBuffer()
+    frame_sync = FrameSync()
+    for notification in notifications:
+        buffer.extend(notification)
+        pos = frame_sync.find(buffer)
+        while pos >= 0:
+            buffer.consume(pos + 4)
+            pos = frame_sync.find(buffer)
+
+
+def scan_growing_old(chunks):
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        start_of_packet(buffer)
+
+
+def scan_growing_new(chunks):
+    buffer = ReassemblyBuffer(capacity=4096)
+    frame_sync = FrameSync()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        frame_sync.find(buffer)
+
+
+def main():
+    notifications = load_hex_lines('bulk_notifications.hex')
+    report(f'Scan synthetic bulk capture ({len(notifications)} notifications)', [
+        ('start_of_packet', measure(lambda: scan_capture_old(notifications))),
+        ('FrameSync', measure(lambda: scan_capture_new(notifications))),
+    ])
+
+    garbage = bytes(range(0x20, 0x20 + 200)) * 5
+    report(f'Scan {len(garbage)} bytes without value start', [
+        ('start_of_packet', measure(lambda: start_of_packet(garbage))),
+        ('find_signature', measure(lambda: find_signature(garbage))),
+    ])
+
+    chunks = [garbage[i:i + 20] for i in range(0, len(garbage), 20)]
+    report(f'Partial buffer growing by 20 bytes ({len(chunks)} notifications) without value start', [
+        ('start_of_packet', measure(lambda: scan_growing_old(chunks))),
+        ('FrameSync', measure(lambda: scan_growing_new(chunks))),
+    ])
+
+
+if __name__ == '__main__':
+    main()
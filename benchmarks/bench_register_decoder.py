@@ -0,0 +1,107 @@
+"""
+Compares the old decode path of VictronBluetooth.handle_one_value with the precompiled register decoders
+Run from repository root: python3 -m benchmarks.bench_register_decoder
+"""
+import logging
+from collections import namedtuple
+from benchmarks.common import load_hex_lines, measure, report
+from lib.victron_bluetooth.frame_sync import find_signature
+from lib.victron_bluetooth.victron_bluetooth import VictronBluetooth, VALUE_TYPES, VARLEN_CATEGORY_LOOKUP, \
+    MIXED_SETTINGS_NAMES
+import lib.helper
+
+logger = logging.getLogger()
+Header = namedtuple("Header", ["value_type", "category_type", "length"])
+
+
+# Decode path of VictronBluetooth before the register decoders
+class LegacyDecoder:
+    def __init__(self, output):
+        self.output = output
+
+    def decode_var_len(self, value, config_table):
+        length = value[1] & 0x0F
+        data = bytes(value[2:2 + length])
+        command = value[0]
+        if command not in config_table:
+            raise KeyError(f"unknown command (in var len) 0x{command:x} in {config_table.keys()}")
+        command = self.get_command(command, config_table)
+        value_string = command[5](data, command)
+        return [{"command": command, "value": value_string}], 2 + length
+
+    def decode_fixed_len(self, value):
+        command = self.get_command(value[0], MIXED_SETTINGS_NAMES)
+        value_string = lib.helper.convert_value_number(bytes(value[1:2]), command)
+        return [{"command": command, "value": value_string}], 2
+
+    def get_command(self, command, command_names):
+        try:
+            return command_names[command]
+        except:
+            return False
+
+    def decode_header(self, header_4b):
+        return Header(VALUE_TYPES(header_4b[0]), int.from_bytes(bytes(header_4b[:4]), "little"), 4)
+
+    def handle_one_value(self, value):
+        header = self.decode_header(value)
+        if len(value) < 6:
+            return -1
+        result = ""
+        consumed = header.length
+        used = 0
+        if header.value_type == VALUE_TYPES.FIXED_LEN:
+            result, used = self.decode_fixed_len(value[consumed:])
+        if header.value_type == VALUE_TYPES.VAR_LEN:
+            category = VARLEN_CATEGORY_LOOKUP[header.category_type]
+            result, used = self.decode_var_len(value[consumed:], category[1])
+        for i in range(len(result)):
+            logger.debug(f'bench: Collected {result[i]["command"][1]} -> {result[i]["value"]}')
+            self.output(result[i]['command'][1], result[i]['value'], vunit=result[i]['command'][2])
+        return consumed + used
+
+
+def split_values(notifications):
+    """
+    :return: List of single values (bytes) from the capture
+    """
+    stream = b''.join(notifications)
+    decoder = LegacyDecoder(lambda category, value, vunit=None: None)
+    values = []
+    pos = find_signature(stream)
+    while pos >= 0:
+        try:
+            consumed = decoder.handle_one_value(memoryview(stream)[pos:])
+            values.append(stream[pos:pos + consumed])
+            pos = find_signature(stream, pos + consumed)
+        except (KeyError, ValueError):
+            pos = find_signature(stream, pos + 1)
+    return values
+
+
+def decode_all(decoder, values):
+    for value in values:
+        decoder.handle_one_value(value)
+
+
+def main():
+    def output(category, value, vunit=None):
+        pass
+
+    def flush(delay=0):
+        pass
+
+    values = split_values(load_hex_lines('bulk_notifications.hex'))
+    legacy = LegacyDecoder(output)
+    current = VictronBluetooth({'name': 'bench', 'type': 'smartshunt'}, output, flush)
+
+    legacy_time = measure(lambda: decode_all(legacy, values))
+    current_time = measure(lambda: decode_all(current, values))
+    report(f'Decode {len(values)} values from synthetic bulk capture (per value)', [
+        ('header IntEnum + tuple lookup', legacy_time / len(values)),
+        ('precompiled register decoders', current_time / len(values)),
+    ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+Compares reading the VE.Direct stream byte by byte with reading whole chunks
+The synthetic streams are written to a pseudo terminal, so both readers do real read system calls.
+Also compares a per-byte state machine as used by the vedirect library with the built-in VedirectParser.
+Run from repository root: python3 -m benchmarks.bench_serial_reader
+"""
+import fcntl
+import os
+import pty
+import struct
+import termios
+from benchmarks.common import FIXTURES, measure, report
+from lib.victron_serial.vedirect_parser import VedirectParser, VedirectReader
+
+
+class PtySerial:
+    """
+    Minimal stand-in for serial.Serial on the slave side of a pseudo terminal
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    @property
+    def in_waiting(self):
+        return struct.unpack('i', fcntl.ioctl(self.fd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+    def read(self, size=1):
+        return os.read(self.fd, size)
+
+
+class Reader:
+    """
+    Object the per byte read loop works on: ser, input() and keep_running
+    """
+
+    def __init__(self, ser, length):
+        self.ser = ser
+        self.remaining = length
+        self.keep_running = True
+        self.reads = 0
+
+    def input(self, byte):
+        self.remaining -= 1
+        if self.remaining == 0:
+            self.keep_running = False
+        return None
+
+
+def read_bytewise(self, callbackFunction):
+    # read loop before chunked reads
+    self.keep_running = True
+    while self.keep_running:
+        data = self.ser.read()
+        for byte in data:
+            packet = self.input(byte)
+            if packet is not None:
+                callbackFunction(packet)
+
+
+def read_chunks(self, callbackFunction):
+    remaining = self.remaining
+
+    def chunk_callback(data):
+        nonlocal remaining
+        remaining -= len(data)
+        if remaining == 0:
+            reader.stop()
+
+    reader = VedirectReader(self.ser, chunk_callback)
+    reader.run()
+
+
+def run(reader_function, stream):
+    master, slave = pty.openpty()
+    tty_attributes = termios.tcgetattr(slave)
+    tty_attributes[3] = 0  # raw, no echo
+    termios.tcsetattr(slave, termios.TCSANOW, tty_attributes)
+    try:
+        os.write(master, stream)
+        reader = Reader(PtySerial(slave), len(stream))
+        reader_function(reader, lambda packet: None)
+    finally:
+        os.close(master)
+        os.close(slave)
+
+
+class BytewiseParser:
+    """
+    Reference: per byte state machine as in the vedirect library, which was used before the built-in parser
+    """
+    (HEX, WAIT_HEADER, IN_KEY, IN_VALUE, IN_CHECKSUM) = range(5)
+
+    def __init__(self):
+        self.state = self.WAIT_HEADER
+        self.key = ''
+        self.value = ''
+        self.bytes_sum = 0
+        self.dict = {}
+
+    def input(self, byte):
+        if byte == 0x3a and self.state != self.IN_CHECKSUM:
+            self.state = self.HEX
+        if self.state == self.WAIT_HEADER:
+            self.bytes_sum += byte
+            if byte == 0x0d:
+                self.state = self.WAIT_HEADER
+            elif byte == 0x0a:
+                self.state = self.IN_KEY
+            return None
+        elif self.state == self.IN_KEY:
+            self.bytes_sum += byte
+            if byte == 0x09:
+                if self.key == 'Checksum':
+                    self.state = self.IN_CHECKSUM
+                else:
+                    self.state = self.IN_VALUE
+            else:
+                self.key += chr(byte)
+            return None
+        elif self.state == self.IN_VALUE:
+            self.bytes_sum += byte
+            if byte == 0x0d:
+                self.state = self.WAIT_HEADER
+                self.dict[self.key] = self.value
+                self.key = ''
+                self.value = ''
+            else:
+                self.value += chr(byte)
+            return None
+        elif self.state == self.IN_CHECKSUM:
+            self.bytes_sum += byte
+            self.key = ''
+            self.value = ''
+            self.state = self.WAIT_HEADER
+            if self.bytes_sum % 256 == 0:
+                self.bytes_sum = 0
+                packet, self.dict = self.dict, {}
+                return packet
+            self.bytes_sum = 0
+            self.dict = {}
+            return None
+        elif self.state == self.HEX:
+            self.bytes_sum = 0
+            if byte == 0x0a:
+                self.state = self.WAIT_HEADER
+            return None
+
+
+def parse_bytewise(stream):
+    parser = BytewiseParser()
+    for byte in stream:
+        parser.input(byte)
+
+
+def parse_builtin(stream, chunk_size=64):
+    parser = VedirectParser()
+    for pos in range(0, len(stream), chunk_size):
+        parser.feed(stream[pos:pos + chunk_size])
+
+
+def main():
+    for name in ['phoenix', 'smartshunt', 'smartsolar']:
+        with open(os.path.join(FIXTURES, f'vedirect_{name}.bin'), 'rb') as fixture:
+            # a pty buffers 4 KiB, roughly 2 seconds at 19200 baud
+            stream = fixture.read()[:4000]
+        report(f'Read {len(stream)} bytes of synthetic {name} stream', [
+            ('read() per byte', measure(lambda: run(read_bytewise, stream))),
+            ('read(in_waiting) chunks', measure(lambda: run(read_chunks, stream))),
+        ])
+
+    for name in ['phoenix', 'smartshunt', 'smartsolar']:
+        with open(os.path.join(FIXTURES, f'vedirect_{name}.bin'), 'rb') as fixture:
+            stream = fixture.read()
+        report(f'Parse {len(stream)} bytes of synthetic {name} stream', [
+            ('per byte state machine', measure(lambda: parse_bytewise(stream))),
+            ('VedirectParser, 64 byte chunks', measure(lambda: parse_builtin(stream))),
+        ])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Compares sending one value to syslog by spawning /usr/bin/logger with the persistent SyslogSink
+Both write to a unix datagram socket in a temporary directory, a thread drains it like a syslog daemon.
+Run from repository root: python3 -m benchmarks.bench_syslog
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+from benchmarks.common import measure, report
+from lib.syslog_sink import SyslogSink
+
+MESSAGE = 'Shunt1|Voltage:13.25'
+LOGGER = '/usr/bin/logger'
+
+
+def drain(sock):
+    try:
+        while True:
+            sock.recv(4096)
+    except OSError:
+        return
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'log')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    server.bind(path)
+    threading.Thread(target=drain, args=(server,), daemon=True).start()
+
+    sink = SyslogSink(path)
+    results = []
+    if os.path.exists(LOGGER):
+        results.append(('subprocess /usr/bin/logger', measure(
+            lambda: subprocess.run([LOGGER, f'--id={os.getpid()}', '-u', path, '-t', 'victron', MESSAGE]), repeat=3)))
+    else:
+        print(f'{LOGGER} not found, only the sink is measured')
+    results.append(('SyslogSink (RFC 5424, open socket)', measure(lambda: sink.send(MESSAGE))))
+    report('Send one value to syslog', results)
+
+    sink.close()
+    server.close()
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import timeit
+# the fixtures are shipped with the simulator
+from lib.simulator.fixtures import FIXTURES, load_characteristic_reads, load_hex_lines
+
+
+def measure(function, repeat=5):
+    """
+    Runs function often enough to get stable timings
+    :param function: Function without arguments
+    :param repeat: Number of timing runs, the best one is used
+    :return: Seconds per call
+    """
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def report(title, results):
+    """
+    Prints timings compared to the first result
+    :param title: Title of benchmark
+    :param results: List of (name, seconds per call)
+    """
+    print(title)
+    baseline = results[0][1]
+    for name, seconds in results:
+        print(f'  {name:<40} {seconds * 1e6:12.2f} us  {baseline / seconds:8.1f}x')
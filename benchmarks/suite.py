@@ -0,0 +1,249 @@
+"""
+Benchmark suite for the decoders and output paths, runs on the synthetic fixtures without hardware.
+Reports values per second and memory allocated per value (tracemalloc) for every case.
+Run from repository root: python3 -m benchmarks.suite [--save FILE] [--baseline FILE] [--threshold 0.8] [CASE ...]
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import tracemalloc
+from contextlib import redirect_stdout
+from benchmarks.common import FIXTURES, load_characteristic_reads, load_hex_lines, measure
+
+
+def discard(*args, **kwargs):
+    pass
+
+
+class Characteristic:
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class FakeMqttClient:
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        pass
+
+
+def read_vedirect_blocks(name):
+    from lib.victron_serial.vedirect_parser import VedirectParser
+    with open(os.path.join(FIXTURES, f'vedirect_{name}.bin'), 'rb') as fixture:
+        return VedirectParser().feed(fixture.read())
+
+
+def case_bluetooth_bulk():
+    from lib.victron_bluetooth.victron_bluetooth import VictronBluetooth
+    notifications = load_hex_lines('bulk_notifications.hex')
+    values = 0
+
+    def count(category, value, vunit=None):
+        nonlocal values
+        values += 1
+
+    device = VictronBluetooth({'name': 'bench', 'type': 'smartshunt'}, count, discard)
+    for notification in notifications:
+        device.handle_bulk_values(notification)
+    device.output = discard
+
+    def run():
+        for notification in notifications:
+            device.handle_bulk_values(notification)
+    return run, values
+
+
+def case_ble_characteristics():
+    from lib.victron_ble.victron_smartshunt_ble import SmartshuntBLE
+    reads = [(Characteristic(uuid), value) for uuid, value in load_characteristic_reads('ble_characteristics.txt')]
+    device = SmartshuntBLE({'name': 'bench'})
+
+    def run():
+        for characteristic, value in reads:
+            device.handle_one_value(discard, characteristic, value)
+    return run, len(reads)
+
+
+def case_helper_converters():
+    import lib.helper as helper
+    number = ("Latest", "Voltage", "V", 100, True, helper.convert_value_number)
+    integer = ("Latest", "Power", "W", 1, True, helper.convert_value_int)
+    factor = ("Latest", "Voltage", "V", 0.001, helper.convert_int_factor)
+    inputs = [
+        (helper.convert_value_number, b'\x2c\x05', number),
+        (helper.convert_value_int, b'\x99\xff', integer),
+        (helper.convert_int_factor, '13259', factor),
+        (helper.convert_int_factor, '-7742', factor),
+    ]
+
+    def run():
+        for function, value, command in inputs:
+            function(value, command)
+    return run, len(inputs)
+
+
+def case_serial_process_packet(name):
+    def setup():
+        from lib.victron_serial.victron_serial import VictronSerial
+        blocks = read_vedirect_blocks(name)
+        device = VictronSerial({'name': 'bench', 'type': name}, discard, discard)
+
+        def run():
+            for block in blocks:
+                device.process_packet(block)
+        return run, sum(len(block) for block in blocks)
+    return setup
+
+
+def case_serial_parser(name):
+    def setup():
+        from lib.victron_serial.vedirect_parser import VedirectParser
+        with open(os.path.join(FIXTURES, f'vedirect_{name}.bin'), 'rb') as fixture:
+            stream = fixture.read()
+        values = sum(len(block) for block in VedirectParser().feed(stream))
+
+        def run():
+            parser = VedirectParser()
+            for pos in range(0, len(stream), 64):
+                parser.feed(stream[pos:pos + 64])
+        return run, values
+    return setup
+
+
+def case_output(logger_name):
+    def setup():
+        import victron
+        blocks = read_vedirect_blocks('smartshunt')
+        values = [(key, value) for block in blocks for key, value in block.items()]
+        victron.config = {'mqtt': {'base_topic': 'victron'}}
+        directory = tempfile.mkdtemp()
+        cleanups = [lambda: shutil.rmtree(directory)]
+
+        if logger_name == 'mqtt':
+            victron.client = FakeMqttClient()
+        elif logger_name == 'syslog':
+            from lib.syslog_sink import SyslogSink
+            path = os.path.join(directory, 'log')
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            server.bind(path)
+            threading.Thread(target=drain, args=(server,), daemon=True).start()
+            victron.syslog_sink = SyslogSink(path)
+            cleanups += [victron.syslog_sink.close, server.close]
+        elif logger_name == 'ndjson':
+            from lib.ndjson_sink import NdjsonSink
+            victron.ndjson_sink = NdjsonSink(os.path.join(directory, 'victron.ndjson'), max_bytes=None)
+            cleanups.insert(0, victron.ndjson_sink.close)
+        output = getattr(victron, f'output_{logger_name}')
+
+        def run():
+            with redirect_stdout(io.StringIO()):
+                for key, value in values:
+                    output('bench', key, value, vunit='V')
+        return run, len(values), cleanups
+    return setup
+
+
+def drain(sock):
+    try:
+        while True:
+            sock.recv(4096)
+    except OSError:
+        return
+
+
+CASES = {
+    'bluetooth_bulk': case_bluetooth_bulk,
+    'ble_characteristics': case_ble_characteristics,
+    'helper_converters': case_helper_converters,
+    'serial_parser_smartshunt': case_serial_parser('smartshunt'),
+    'serial_process_packet_phoenix': case_serial_process_packet('phoenix'),
+    'serial_process_packet_smartshunt': case_serial_process_packet('smartshunt'),
+    'serial_process_packet_smartsolar': case_serial_process_packet('smartsolar'),
+    'output_print': case_output('print'),
+    'output_json': case_output('json'),
+    'output_mqtt': case_output('mqtt'),
+    'output_syslog': case_output('syslog'),
+    'output_ndjson': case_output('ndjson'),
+}
+
+
+def allocated_per_call(function):
+    """
+    :return: (peak bytes allocated during one call, blocks still allocated after the call)
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        before_blocks = sys.getallocatedblocks()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        function()
+        current, peak = tracemalloc.get_traced_memory()
+        gc.collect()
+        retained = sys.getallocatedblocks() - before_blocks
+    finally:
+        tracemalloc.stop()
+    return peak - before, retained
+
+
+def run_case(name):
+    result = CASES[name]()
+    function, values = result[0], result[1]
+    cleanups = result[2] if len(result) > 2 else []
+    try:
+        seconds = measure(function)
+        peak, retained = allocated_per_call(function)
+    finally:
+        for cleanup in cleanups:
+            cleanup()
+    return {
+        'values_per_second': values / seconds,
+        'peak_bytes_per_value': peak / values,
+        'retained_blocks_per_value': retained / values,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark suite for decoders and outputs')
+    parser.add_argument('cases', nargs='*', help=f'Cases to run [Default: all]: {", ".join(CASES)}')
+    parser.add_argument('--save', help='Write results as json to this file')
+    parser.add_argument('--baseline', help='Compare with results saved before, fail if a case got slower')
+    parser.add_argument('--threshold', type=float, default=0.8,
+                        help='Fail if values/s falls below threshold * baseline [Default: 0.8]')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    regressions = []
+    print(f'  {"case":<36} {"values/s":>12} {"peak B/value":>13} {"retained/value":>15} {"vs baseline":>12}')
+    for name in args.cases or CASES:
+        results[name] = result = run_case(name)
+        compare = ''
+        if name in baseline:
+            ratio = result['values_per_second'] / baseline[name]['values_per_second']
+            compare = f'{ratio:.2f}x'
+            if ratio < args.threshold:
+                regressions.append(name)
+        print(f'  {name:<36} {result["values_per_second"]:12.0f} {result["peak_bytes_per_value"]:13.1f} '
+              f'{result["retained_blocks_per_value"]:15.2f} {compare:>12}')
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2)
+    if regressions:
+        print(f'Slower than {args.threshold} * baseline: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import argparse
+import json
+import logging
+import struct
+import threading
+import time
+
+logger = logging.getLogger()
+
+# File: MAGIC, VERSION, length of header (uint32), header json (device config), records
+# Record: timestamp (double), kind (uint8), uuid index (uint16), length of data (uint32), data
+# A uuid is written once as record of kind KIND_UUID, later records refer to it by its index
+MAGIC = b'VCAP'
+VERSION = 1
+HEADER_LENGTH = struct.Struct('<I')
+RECORD = struct.Struct('<dBHI')
+
+KIND_UUID = 0
+# Value of a characteristic, notification or read (bluetooth and bluetooth-ble)
+KIND_CHARACTERISTIC = 1
+# Chunk of bytes read from a serial port
+KIND_SERIAL = 2
+
+NO_UUID = 0xFFFF
+
+
+class CaptureWriter:
+    """
+    Records the raw traffic of one device into a compact binary capture file
+    """
+
+    def __init__(self, path, device_config):
+        """
+        :param path: Capture file
+        :param device_config: Config of the recorded device, stored in the header for replay
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.uuids = {}
+        self.records = 0
+        self.file = open(path, 'wb')
+        header = json.dumps({key: device_config[key] for key in ('name', 'type', 'protocol')}).encode('utf-8')
+        self.file.write(MAGIC + bytes([VERSION]) + HEADER_LENGTH.pack(len(header)) + header)
+
+    def record(self, kind, data, uuid=None, timestamp=None):
+        """
+        :param kind: KIND_CHARACTERISTIC or KIND_SERIAL
+        :param data: Raw bytes
+        :param uuid: Characteristic uuid
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        data = bytes(data)
+        with self.lock:
+            if self.file is None:
+                return
+            index = NO_UUID
+            if uuid is not None:
+                index = self.uuids.get(uuid)
+                if index is None:
+                    index = self.uuids[uuid] = len(self.uuids)
+                    encoded = uuid.encode('ascii')
+                    self.file.write(RECORD.pack(timestamp, KIND_UUID, index, len(encoded)) + encoded)
+            self.file.write(RECORD.pack(timestamp, kind, index, len(data)) + data)
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        logger.info(f'Capture: recorded {self.records} records to {self.path}')
+
+
+def read_capture(path):
+    """
+    :param path: Capture file
+    :return: (device config, list of (timestamp, kind, uuid, data))
+    """
+    with open(path, 'rb') as capture:
+        content = capture.read()
+    if content[:len(MAGIC)] != MAGIC or content[len(MAGIC)] != VERSION:
+        raise ValueError(f'{path} is not a capture file of version {VERSION}')
+    pos = len(MAGIC) + 1
+    header_length, = HEADER_LENGTH.unpack_from(content, pos)
+    pos += HEADER_LENGTH.size
+    device_config = json.loads(content[pos:pos + header_length])
+    pos += header_length
+
+    uuids = {}
+    records = []
+    while pos + RECORD.size <= len(content):
+        timestamp, kind, index, length = RECORD.unpack_from(content, pos)
+        pos += RECORD.size
+        data = content[pos:pos + length]
+        pos += length
+        if kind == KIND_UUID:
+            uuids[index] = data.decode('ascii')
+        else:
+            records.append((timestamp, kind, uuids.get(index), data))
+    return device_config, records
+
+
+class Characteristic:
+    """
+    Characteristic as given by gatt to the value handlers, replay only needs the uuid
+    """
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+def create_replay_device(device_config, output, flush):
+    """
+    Creates the decoder of the recorded device without connecting to it
+    :return: Function(kind, uuid, data) feeding one record into the decoder
+    """
+    if device_config['protocol'] == 'serial':
+        from lib.victron_serial.victron_serial import VictronSerial
+        device = VictronSerial(device_config, output, flush)
+        # all blocks are processed, not only the one at the timer
+        device.read_data_callback = device.process_packet
+        return lambda kind, uuid, data: device.feed(data)
+
+    if device_config['protocol'] == 'bluetooth-ble':
+        from lib.victron_ble.victron_ble import VictronBle
+        device = VictronBle(device_config, output, flush)
+        characteristics = {}
+
+        def feed_ble(kind, uuid, data):
+            if uuid not in characteristics:
+                characteristics[uuid] = Characteristic(uuid)
+            device.handle_value(characteristics[uuid], data)
+        return feed_ble
+
+    if device_config['protocol'] == 'bluetooth':
+        from lib.victron_bluetooth.victron_bluetooth import VictronBluetooth
+        device = VictronBluetooth(device_config, output, flush)
+        notification_table = device.victron_device.get_notification_table(device.handle_single_value,
+                                                                           device.handle_bulk_values)
+
+        def feed_bluetooth(kind, uuid, data):
+            if uuid in notification_table:
+                notification_table[uuid](data)
+        return feed_bluetooth
+
+    raise RuntimeError(f'Got unknown protocol ({device_config["protocol"]}) from capture!')
+
+
+def replay(path, output, flush=lambda delay=0: None, realtime=False):
+    """
+    Feeds a capture file through the decoder of the recorded device
+    :param path: Capture file
+    :param output: Function(category, value, vunit=None)
+    :param flush: Function(delay=0), called at the end of a frame
+    :param realtime: Keep the time between the records, otherwise as fast as possible
+    :return: (number of records, seconds)
+    """
+    device_config, records = read_capture(path)
+    # without port/mac nothing is opened or connected
+    device_config = dict(device_config, port=None, mac=None)
+    feed = create_replay_device(device_config, output, flush)
+
+    start = time.perf_counter()
+    first_timestamp = records[0][0] if records else 0
+    for timestamp, kind, uuid, data in records:
+        if realtime:
+            delay = timestamp - first_timestamp - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        feed(kind, uuid, data)
+    return len(records), time.perf_counter() - start
+
+
+def replay_command(argv):
+    """
+    Command line: victron.py replay FILE [--realtime] [--count]
+    """
+    parser = argparse.ArgumentParser(prog='victron.py replay', description='Replay a recorded capture')
+    parser.add_argument('file', help='Capture file recorded with --record')
+    parser.add_argument('--realtime', action='store_true', help='Keep the recorded timing [Default: as fast as possible]')
+    parser.add_argument('--count', action='store_true', help='Only count the decoded values and print the throughput')
+    args = parser.parse_args(argv)
+
+    values = 0
+
+    def output(category, value, vunit=None):
+        nonlocal values
+        values += 1
+        if not args.count:
+            print(f'{category}:{value}{" " + vunit if vunit else ""}')
+
+    records, seconds = replay(args.file, output, realtime=args.realtime)
+    print(f'Replayed {records} records, {values} values in {seconds:.3f} s ({values / max(seconds, 1e-9):.0f} values/s)')
@@ -0,0 +1,98 @@
+import logging
+import time
+import lib.metrics as metrics
+
+logger = logging.getLogger()
+
+# Steps of a bluetooth connect cycle in their usual order, every step is marked when it ends
+PHASES = [
+    'adapter_lock',              # waiting for the other devices on the adapter
+    'start_discovery',
+    'discovery_sleep',
+    'connect',
+    'services_resolved',
+    'notifications_subscribed',  # bluetooth-ble: also all reads requested
+    'init_sequence',             # bluetooth only: all init writes acknowledged
+    'first_value',
+    'last_value',
+    'disconnect',
+]
+
+# Percentiles of the phases are logged every this many cycles
+SUMMARY_CYCLES = 10
+
+
+class CycleTimer:
+    """
+    Timestamps the steps of one connect cycle with a monotonic clock.
+    At the end of the cycle the duration of every step (from the end of the step before) is logged as one structured
+    record and added to the running percentiles of the device.
+    """
+
+    def __init__(self, name):
+        """
+        :param name: Name of device
+        """
+        self.name = name
+        self.start = time.monotonic()
+        # phase -> monotonic time at the end of the phase
+        self.marks = {}
+
+    def mark(self, phase):
+        """
+        Marks the end of phase, only the first mark of a phase in a cycle counts
+        """
+        if phase not in self.marks:
+            self.marks[phase] = time.monotonic()
+
+    def phases(self):
+        """
+        :return: {phase: seconds since the end of the phase before}, in order of time
+        """
+        durations = {}
+        previous = self.start
+        for phase, timestamp in sorted(self.marks.items(), key=lambda item: item[1]):
+            durations[phase] = timestamp - previous
+            previous = timestamp
+        return durations
+
+    def finish(self, connected):
+        """
+        :param connected: If the device was connected in this cycle
+        :return: {phase: seconds}
+        """
+        durations = self.phases()
+        total = max(self.marks.values(), default=self.start) - self.start
+        record = {
+            'device': self.name,
+            'connected': connected,
+            'total': round(total, 4),
+            'phases': {phase: round(seconds, 4) for phase, seconds in durations.items()},
+        }
+        # with the json log format the record is written as structure, the message is for the text format
+        phases = ', '.join(f'{phase} {seconds:.3f}' for phase, seconds in durations.items())
+        # a device out of range fails every retry, those cycles only at debug
+        level = logging.INFO if connected else logging.DEBUG
+        logger.log(level, f'{self.name}: Cycle timing {total:.3f} s: {phases}', extra={'cycle_timing': record})
+
+        for phase, seconds in durations.items():
+            metrics.CONNECT_PHASE.labels(self.name, phase).observe(seconds)
+        total_summary = metrics.CONNECT_PHASE.labels(self.name, 'total')
+        total_summary.observe(total)
+        if total_summary.count % SUMMARY_CYCLES == 0:
+            log_percentiles(self.name)
+        return durations
+
+
+def log_percentiles(name):
+    """
+    Logs median and 90th percentile of every phase of the device over the last cycles
+    """
+    parts = []
+    for phase in PHASES + ['total']:
+        summary = metrics.CONNECT_PHASE.children.get((name, phase))
+        if summary is None:
+            continue
+        median, p90 = summary.quantiles([0.5, 0.9])
+        parts.append(f'{phase} {median:.3f}/{p90:.3f}')
+    logger.info(f'{name}: Cycle timing p50/p90 [s]: {", ".join(parts)}')
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+import lib.metrics as metrics
+from lib.cycle_timing import CycleTimer
+
+logger = logging.getLogger()
+
+ADAPTER_NAME = "hci0"
+
+# Seconds to wait for connect_succeeded or connect_failed
+CONNECT_TIMEOUT = 30
+
+# Discovery and connect must not run concurrently for several devices on the same adapter
+adapter_lock = threading.Lock()
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """
+    Returns the gatt device manager shared by all bluetooth devices of this process.
+    On first use the manager is created and its main loop is started in a background thread, so every device
+    receives its events from the same loop and no device has to run or stop the loop itself.
+    :return: gatt.DeviceManager
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            import dbus.mainloop.glib
+            import gatt
+
+            dbus.mainloop.glib.threads_init()
+            _manager = gatt.DeviceManager(adapter_name=ADAPTER_NAME)
+            threading.Thread(target=_manager.run, name='gatt-main-loop', daemon=True).start()
+            logger.debug(f'Started gatt main loop for adapter {ADAPTER_NAME}')
+    return _manager
+
+
+def call_later(seconds, function, *args):
+    """
+    Runs function on the gatt main loop after seconds, for pauses in event handlers: a sleep in a handler would stop
+    the events of all devices
+    """
+    from gi.repository import GLib
+
+    def run():
+        function(*args)
+        # run once
+        return False
+
+    GLib.timeout_add(int(seconds * 1000), run)
+
+
+def connect_and_wait(gatt_device, name):
+    """
+    Runs one connection cycle of a gatt device: discovery, connect and wait until the device disconnects again
+    :param gatt_device: Device instance with a "disconnected" event
+    :param name: Name of device (for logging)
+    :return: Boolean: If the device was connected
+    """
+    manager = get_manager()
+    metrics.CONNECT_ATTEMPTS.labels(name).inc()
+    # the device marks its own steps (services resolved, first value, ...) on the same timer
+    timer = gatt_device.cycle_timer = CycleTimer(name)
+    connected = False
+    try:
+        with adapter_lock:
+            timer.mark('adapter_lock')
+            manager.start_discovery()
+            timer.mark('start_discovery')
+            time.sleep(1)
+            timer.mark('discovery_sleep')
+
+            try:
+                logger.info(f'{name}: Connecting...')
+                gatt_device.connected = False
+                gatt_device.connect_finished.clear()
+                gatt_device.disconnected.clear()
+                gatt_device.last_value_time = None
+                connect_time = time.monotonic()
+                gatt_device.connect()
+                # the result arrives as connect_succeeded or connect_failed on the main loop
+                if not gatt_device.connect_finished.wait(CONNECT_TIMEOUT):
+                    logger.error(f'{name}: No connection after {CONNECT_TIMEOUT} seconds. Trying again shortly.')
+                    gatt_device.disconnect()
+            except:
+                logger.error(f'{name}: failed to connect. Trying again shortly.')
+                metrics.CONNECT_FAILURES.labels(name).inc()
+                return False
+            finally:
+                timer.mark('connect')
+                manager.stop_discovery()
+
+        if not gatt_device.connected:
+            metrics.CONNECT_FAILURES.labels(name).inc()
+            return False
+
+        connected = True
+        gatt_device.disconnected.wait()
+        if gatt_device.last_value_time is not None:
+            timer.marks['last_value'] = gatt_device.last_value_time
+            metrics.CONNECT_TO_LAST_VALUE.labels(name).observe(gatt_device.last_value_time - connect_time)
+        return True
+    finally:
+        timer.finish(connected)
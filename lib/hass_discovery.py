@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger()
+
+DEFAULT_CACHE_FILE = 'cache/hass_discovery.json'
+
+_discovery = None
+_discovery_lock = threading.Lock()
+
+
+def get_discovery(cache_file=DEFAULT_CACHE_FILE):
+    """
+    Returns the discovery manager shared by all devices of this process
+    :param cache_file: File with the hashes of the published configs, only used on first call
+    :return: HassDiscovery
+    """
+    global _discovery
+    with _discovery_lock:
+        if _discovery is None:
+            _discovery = HassDiscovery(cache_file)
+    return _discovery
+
+
+class HassDiscovery:
+    """
+    Publishes homeassistant discovery configs only if they changed since they were last published.
+    The hashes of the published configs are kept in a file, so a restart does not publish all configs again.
+    Configs of values a device does not have anymore are removed with an empty retained message.
+    """
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        # device name -> {config topic: hash of config}
+        self.hashes = self.load()
+        # device name -> (output, [(config topic, config json)]), to republish if homeassistant restarts
+        self.devices = {}
+
+    def load(self):
+        try:
+            with open(self.cache_file, 'r') as cache:
+                return json.load(cache)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f'HASS discovery: could not read cache {self.cache_file}, publishing all configs: {e}')
+            return {}
+
+    def save(self):
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_file = f'{self.cache_file}.tmp'
+        with open(temp_file, 'w') as cache:
+            json.dump(self.hashes, cache)
+        os.replace(temp_file, self.cache_file)
+
+    @staticmethod
+    def hash(data):
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def publish(self, device_name, payloads, output, force=False):
+        """
+        :param device_name: Name of device
+        :param payloads: List of (config topic, config json) of all values of the device
+        :param output: Output function
+        :param force: Publish all configs, even if they did not change
+        """
+        with self.lock:
+            self.devices[device_name] = (output, payloads)
+            old_hashes = self.hashes.get(device_name, {})
+            new_hashes = {}
+            published = 0
+            failed = 0
+            for topic, data in payloads:
+                digest = self.hash(data)
+                if not force and old_hashes.get(topic) == digest:
+                    new_hashes[topic] = digest
+                elif self.send(output, device_name, topic, data):
+                    new_hashes[topic] = digest
+                    published += 1
+                else:
+                    # keep the old hash, the config is published again next time
+                    failed += 1
+                    if topic in old_hashes:
+                        new_hashes[topic] = old_hashes[topic]
+            for topic in old_hashes.keys() - new_hashes.keys():
+                if self.send(output, device_name, topic, ''):
+                    logger.info(f'{device_name}: HASS discovery: removed config {topic}')
+                else:
+                    failed += 1
+                    new_hashes[topic] = old_hashes[topic]
+
+            self.hashes[device_name] = new_hashes
+            try:
+                self.save()
+            except OSError as e:
+                logger.warning(f'HASS discovery: could not write cache {self.cache_file}: {e}')
+        logger.info(f'{device_name}: HASS discovery: published {published} of {len(payloads)} configs'
+                    + (f', {failed} failed' if failed else ''))
+
+    @staticmethod
+    def send(output, device_name, topic, data):
+        """
+        :return: If the output accepted the config, the mqtt output returns the MQTTMessageInfo of the publish
+        """
+        try:
+            result = output(device_name, topic, data, hass_config=True)
+        except Exception as e:
+            logger.warning(f'{device_name}: HASS discovery: could not publish {topic}: {e}')
+            return False
+        if getattr(result, 'rc', 0):
+            logger.warning(f'{device_name}: HASS discovery: could not publish {topic}: error {result.rc}')
+            return False
+        return True
+
+    def republish(self):
+        """
+        Publishes all known configs again, e.g. if homeassistant came online and lost its retained configs
+        """
+        with self.lock:
+            devices = list(self.devices.items())
+        for device_name, (output, payloads) in devices:
+            self.publish(device_name, payloads, output, force=True)
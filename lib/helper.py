@@ -10,13 +10,24 @@ def extract_firmware_version(value):
         version = f'v{value[1]}.{value[0]:02}'
     return version
 
+def scale_value(raw, scale):
+    """
+    Converts a raw register value into its unit, values without scale stay int
+    :param raw: Raw integer value
+    :param scale: Divisor of the raw value
+    :return: int or float
+    """
+    if scale == 1:
+        return raw
+    return raw / scale
+
 def convert_value_number(value, command):
     converted = int.from_bytes(value, "little", signed=command[4])
-    return str(converted / command[3])
+    return scale_value(converted, command[3])
 
 def convert_value_int(value, command):
     converted = int.from_bytes(value, "little", signed=command[4])
-    return str(int(converted / command[3]))
+    return int(converted / command[3])
 
 def convert_value_string(value, command):
     return str(value.decode("ASCII"))
@@ -42,15 +53,14 @@ def convert_value_unknown(value, command):
 ## START: SERIAL CONVERT FUNCTIONS
 def convert_int_factor(value, command):
     try:
-        int(value)
+        data = int(value)
     except ValueError:
         return str(value)
 
-    data = int(value) * command[3]
-    if type(data) == int:
-        return str(data)
-    else:
-        return f'{data:.2f}'
+    if type(command[3]) == int:
+        return data * command[3]
+    # Divide by the inverse factor, multiplying with e.g. 0.001 adds float noise (13.232000000000001)
+    return data / round(1 / command[3])
 
 
 def convert_str_out(value, command):
@@ -88,14 +98,7 @@ def convert_production_date(value, command):
 ## END: SERIAL CONVERT FUNCTIONS
 
 
-def collection_check_full(collection):
-    for value in collection.values():
-        if value is None:
-            return False
-    return True
-
-
-def build_hass_discovery_config(device_name, model, serial, firmware, sensor_config, base_topic, subtopic, value_template, collection):
+def build_hass_discovery_config(device_name, model, serial, firmware, sensor_config, base_topic, subtopic, value_template, collection, batch=False):
     """
     Builds the config for homeassistant mqtt discovery
     :param device_name: Name of device
@@ -107,6 +110,7 @@ def build_hass_discovery_config(device_name, model, serial, firmware, sensor_con
     :param subtopic: Subtopic is either the name of the sensor (e.g. Voltage) or of the collection (e.g. latest)
     :param value_template: sensor (e.g. Voltage)
     :param collection: None or a collection
+    :param batch: Values are published batched as one json document on the device topic
     :return:
     """
     hass_config_topic = f'homeassistant/sensor/{device_name}/{value_template.replace(" ", "_")}/config'
@@ -154,10 +158,19 @@ def build_hass_discovery_config(device_name, model, serial, firmware, sensor_con
     if sensor_config[0] == 'Battery':
         hass_config_data["expire_after"] = 600
 
+    # batched values are read from the json document on the device topic
+    batched = batch and collection is None
+    value = f"value_json['{value_template}']" if batched else 'value'
+
     if sensor_config[0] == 'Time':
-        hass_config_data["value_template"] = "{% if value|string == '-1.0' %}infinit{% else %}{{ value }} minutes{% endif %}"
+        hass_config_data["value_template"] = "{% if " + value + "|float == -1 %}infinit{% else %}{{ " + value + " }} minutes{% endif %}"
+    elif batched and sensor_config[2] != 'timestamp':
+        hass_config_data["value_template"] = "{{ " + value + " }}"
 
-    hass_config_data["state_topic"] = f'{base_topic}/{device_name}/{subtopic}'
+    if batched:
+        hass_config_data["state_topic"] = f'{base_topic}/{device_name}'
+    else:
+        hass_config_data["state_topic"] = f'{base_topic}/{device_name}/{subtopic}'
 
     if collection is not None:
         hass_config_data["value_template"] = "{{ value_json['" + value_template + "'] }}"
@@ -175,7 +188,12 @@ def build_hass_discovery_config(device_name, model, serial, firmware, sensor_con
     return hass_config_topic, json.dumps(hass_config_data)
 
 
-def send_hass_config_payload(device_name, pid, ser, fw, mapping_table, base_topic, output, collections):
+def build_hass_config_payloads(device_name, pid, ser, fw, mapping_table, base_topic, collections, batch=False):
+    """
+    Builds the homeassistant discovery configs of all values of a device
+    :return: List of (config topic, config json)
+    """
+    payloads = []
     for key, value in mapping_table.items():
         subtopic = value[1]
         value_template = value[1]
@@ -187,7 +205,7 @@ def send_hass_config_payload(device_name, pid, ser, fw, mapping_table, base_topi
                     subtopic = ckey
                     collection = ckey
 
-        hass_config_subtopic, hass_config_data = build_hass_discovery_config(
+        payloads.append(build_hass_discovery_config(
             device_name,
             pid,
             ser,
@@ -196,10 +214,9 @@ def send_hass_config_payload(device_name, pid, ser, fw, mapping_table, base_topi
             base_topic,
             subtopic,
             value_template,
-            collection
-        )
-
-        output(device_name, hass_config_subtopic, hass_config_data, hass_config=True)
+            collection,
+            batch
+        ))
 
     if len(list(mapping_table.items())) > 0:
         subtopic_updated = list(mapping_table.items())[0][1][1]
@@ -207,7 +224,7 @@ def send_hass_config_payload(device_name, pid, ser, fw, mapping_table, base_topi
         subtopic_updated = 'missing_mapping_table'
 
     # Add an updated timestamp sensor
-    hass_config_subtopic, hass_config_data = build_hass_discovery_config(
+    payloads.append(build_hass_discovery_config(
         device_name,
         pid,
         ser,
@@ -216,7 +233,8 @@ def send_hass_config_payload(device_name, pid, ser, fw, mapping_table, base_topi
         base_topic,
         subtopic_updated,
         'Updated',
-        None
-    )
+        None,
+        batch
+    ))
+    return payloads
 
-    output(device_name, hass_config_subtopic, hass_config_data, True)
@@ -0,0 +1,118 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from datetime import datetime
+
+DEFAULT_FORMAT = 'json'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+DEFAULT_QUEUE_SIZE = 10000
+
+TEXT_FORMAT = '[%(levelname)-7s] (%(asctime)s) %(threadName)s %(filename)s::%(lineno)d %(message)s'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Attributes every LogRecord has, everything else was given with extra={...}
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json document per line, with the attributes given by extra={...} as additional keys
+    """
+
+    def format(self, record):
+        document = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_text:
+            document['exception'] = record.exc_text
+        elif record.exc_info:
+            document['exception'] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                document[key] = value
+        return json.dumps(document, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands the records to the writer thread, drops them if the queue is full instead of blocking the caller
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the message is built on the calling thread, the arguments may change later
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogListener(logging.handlers.QueueListener):
+    def stop(self):
+        # may be called at exit after it was stopped already
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(log_file, level=logging.INFO, console=False, log_config=None):
+    """
+    Logs of the whole process are written by one background thread, to a rotating file and optionally to stdout
+    :param log_file: Log file, rotated at max_bytes
+    :param level: Log level
+    :param console: Also write the records to stdout (as text)
+    :param log_config: log section of the config
+    :return: LogListener, stopped at exit
+    """
+    log_config = log_config or {}
+    directory = os.path.dirname(log_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    file_handler = logging.handlers.RotatingFileHandler(log_file,
+                                                        maxBytes=log_config.get('max_bytes', DEFAULT_MAX_BYTES),
+                                                        backupCount=log_config.get('backup_count',
+                                                                                   DEFAULT_BACKUP_COUNT),
+                                                        encoding='utf-8')
+    if log_config.get('format', DEFAULT_FORMAT) == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+    handlers = [file_handler]
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT, DATE_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue = queue.Queue(log_config.get('queue_size', DEFAULT_QUEUE_SIZE))
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = LogListener(log_queue, *handlers)
+    listener.start()
+    # write the records still in the queue
+    atexit.register(listener.stop)
+    return listener
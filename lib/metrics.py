@@ -0,0 +1,271 @@
+"""
+Counters, histograms and summaries per device, exposed in the Prometheus text format on an optional HTTP endpoint.
+The metrics are always collected (one lock and an addition per update), the endpoint only runs if configured.
+"""
+import bisect
+import logging
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger()
+
+# 9100 is the port of the node_exporter, which often runs on the same host
+DEFAULT_PORT = 9489
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# All metrics in order of registration
+REGISTRY = []
+
+
+class CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """
+        :param function: Function without arguments, called on every scrape instead of keeping a value
+        """
+        self.function = function
+
+    def get(self):
+        return self.function() if self.function is not None else self.value
+
+
+class HistogramChild:
+    __slots__ = ('buckets', 'counts', 'sum', 'lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # one more for +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class SummaryChild:
+    __slots__ = ('window', 'count', 'sum', 'lock')
+
+    def __init__(self, window):
+        # the quantiles are calculated over the last observations only
+        self.window = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.window.append(value)
+            self.count += 1
+            self.sum += value
+
+    def quantiles(self, quantiles):
+        """
+        :param quantiles: List of quantiles, e.g. [0.5, 0.9]
+        :return: List of values (nearest rank), None without observations
+        """
+        with self.lock:
+            values = sorted(self.window)
+        if not values:
+            return [None] * len(quantiles)
+        return [values[min(int(quantile * len(values)), len(values) - 1)] for quantile in quantiles]
+
+
+class Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=('device',)):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        # label values -> child
+        self.children = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """
+        :param values: Label values, the name of the device first
+        :return: Child of the labels, can be kept by the caller to skip the lookup
+        """
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.create_child())
+        return child
+
+    def create_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        # labels() may add a child while the metric is rendered
+        with self.lock:
+            children = sorted(self.children.items())
+        for values, child in children:
+            labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(self.label_names, values))
+            lines += self.render_child(labels, child)
+        return lines
+
+    def render_child(self, labels, child):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def create_child(self):
+        return CounterChild()
+
+    def render_child(self, labels, child):
+        return [f'{self.name}{{{labels}}} {child.value}']
+
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def create_child(self):
+        return GaugeChild()
+
+    def render_child(self, labels, child):
+        return [f'{self.name}{{{labels}}} {child.get()}' if labels else f'{self.name} {child.get()}']
+
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, buckets):
+        self.buckets = sorted(buckets)
+        super().__init__(name, documentation)
+
+    def create_child(self):
+        return HistogramChild(self.buckets)
+
+    def render_child(self, labels, child):
+        with child.lock:
+            counts = list(child.counts)
+            total = child.sum
+        lines = []
+        cumulative = 0
+        for bucket, count in zip(self.buckets + [float('inf')], counts):
+            cumulative += count
+            bound = '+Inf' if bucket == float('inf') else repr(float(bucket))
+            lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_sum{{{labels}}} {total}')
+        lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class Summary(Metric):
+    metric_type = 'summary'
+    QUANTILES = [0.5, 0.9, 0.99]
+
+    def __init__(self, name, documentation, label_names=('device',), window=100):
+        self.window = window
+        super().__init__(name, documentation, label_names)
+
+    def create_child(self):
+        return SummaryChild(self.window)
+
+    def render_child(self, labels, child):
+        lines = []
+        for quantile, value in zip(self.QUANTILES, child.quantiles(self.QUANTILES)):
+            if value is not None:
+                lines.append(f'{self.name}{{{labels},quantile="{quantile}"}} {value}')
+        lines.append(f'{self.name}_sum{{{labels}}} {child.sum}')
+        lines.append(f'{self.name}_count{{{labels}}} {child.count}')
+        return lines
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+VALUES_DECODED = Counter('victron_values_decoded_total', 'Values decoded from the device')
+VALUES_PUBLISHED = Counter('victron_values_published_total', 'Values handed to the output queue')
+UNRECOGNIZED_FRAMES = Counter('victron_unrecognized_frames_total', 'Frames or bytes the decoder could not handle')
+CONNECT_ATTEMPTS = Counter('victron_connect_attempts_total', 'Bluetooth connection attempts')
+CONNECT_FAILURES = Counter('victron_connect_failures_total', 'Bluetooth connection attempts which failed')
+CONNECT_TO_LAST_VALUE = Histogram('victron_connect_to_last_value_seconds',
+                                  'Time from connect until the last value of a read cycle',
+                                  [0.5, 1, 2, 5, 10, 20, 30, 60, 120])
+CONNECT_PHASE = Summary('victron_connect_phase_seconds',
+                        'Duration of the phases of a bluetooth connect cycle, quantiles over the last 100 cycles',
+                        label_names=('device', 'phase'))
+SERIAL_FRAMES_RECEIVED = Counter('victron_serial_frames_received_total', 'VE.Direct blocks with a valid checksum')
+SERIAL_CHECKSUM_ERRORS = Counter('victron_serial_checksum_errors_total', 'VE.Direct blocks with a wrong checksum')
+SERIAL_FRAMES_PROCESSED = Counter('victron_serial_frames_processed_total', 'VE.Direct blocks which were decoded')
+OUTPUT_QUEUE_DEPTH = Gauge('victron_output_queue_depth', 'Values waiting in the output queue', label_names=())
+OUTPUT_DROPPED = Counter('victron_output_dropped_total', 'Values dropped because the output queue was full')
+OUTPUT_COALESCED = Counter('victron_output_coalesced_total',
+                           'Values replaced by a newer value of the same name while waiting in the output queue')
+OUTPUT_QUEUE_WAIT = Histogram('victron_output_queue_wait_seconds',
+                              'Time a value waited in the output queue before it was published',
+                              [0.0001, 0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+PUBLISH_LATENCY = Histogram('victron_output_publish_seconds', 'Time spent in the output for one publish',
+                            [0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1])
+
+
+def render():
+    """
+    :return: All metrics in the Prometheus text format
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f'Metrics: {self.address_string()} {format % args}')
+
+
+def start_server(metrics_config):
+    """
+    Serves /metrics in a background thread
+    :param metrics_config: metrics section of the config
+    :return: ThreadingHTTPServer
+    """
+    address = metrics_config.get('address', '')
+    port = metrics_config.get('port', DEFAULT_PORT)
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f'Metrics: serving http://{address or "0.0.0.0"}:{port}/metrics')
+    return server
@@ -0,0 +1,147 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger()
+
+DEFAULT_BUFFER_SIZE = 64 * 1024
+DEFAULT_FLUSH_INTERVAL = 5
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+
+
+class NdjsonSink:
+    """
+    Writes one json document per line into a file with a large write buffer.
+    The buffer is written when it is full or when flush_interval seconds passed since the last flush, also if no
+    more lines are written: a background thread checks every flush_interval seconds.
+    The file is rotated when it reaches max_bytes or after rotate_interval seconds, rotated segments are optionally
+    compressed with gzip in a background thread.
+    """
+
+    def __init__(self, path, buffer_size=DEFAULT_BUFFER_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 max_bytes=DEFAULT_MAX_BYTES, rotate_interval=None, compress=False, backup_count=None):
+        """
+        :param path: File to write to, rotated segments get a timestamp suffix
+        :param buffer_size: Bytes buffered before they are written
+        :param flush_interval: Seconds after which buffered lines are written at the latest
+        :param max_bytes: Rotate when the file reaches this size, None to disable
+        :param rotate_interval: Rotate after this many seconds, None to disable
+        :param compress: Compress rotated segments with gzip
+        :param backup_count: Number of rotated segments to keep, None keeps all
+        """
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.backup_count = backup_count
+        self.lock = threading.Lock()
+        # rotated segments are finished one after another
+        self.segment_lock = threading.Lock()
+        self.file = None
+        self.size = 0
+        self.opened = 0
+        self.last_flush = 0
+        self.open()
+        self.closed = threading.Event()
+        threading.Thread(target=self.run_timer, name='ndjson-flush', daemon=True).start()
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8', buffering=self.buffer_size)
+        self.size = self.file.tell()
+        self.opened = time.monotonic()
+        self.last_flush = self.opened
+
+    def write(self, record):
+        """
+        :param record: dict, written as one line
+        """
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        # max_bytes and tell() count bytes, not characters
+        length = len(line.encode('utf-8'))
+        now = time.monotonic()
+        with self.lock:
+            if self.file is None:
+                return
+            if self.needs_rotation(now, length):
+                self.rotate()
+            self.file.write(line)
+            self.size += length
+            if now - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = now
+
+    def run_timer(self):
+        while not self.closed.wait(self.flush_interval):
+            self.check_timers()
+
+    def check_timers(self):
+        """
+        Flushes and rotates on time while no lines are written
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.file is None:
+                return
+            if self.needs_rotation(now, 0):
+                self.rotate()
+            elif now - self.last_flush >= self.flush_interval:
+                self.file.flush()
+                self.last_flush = now
+
+    def needs_rotation(self, now, length):
+        if self.size == 0:
+            return False
+        if self.max_bytes and self.size + length > self.max_bytes:
+            return True
+        return self.rotate_interval is not None and now - self.opened >= self.rotate_interval
+
+    def rotate(self):
+        self.file.close()
+        segment = f'{self.path}.{datetime.now():%Y%m%d-%H%M%S-%f}'
+        os.rename(self.path, segment)
+        logger.debug(f'NDJSON: rotated {self.path} to {segment}')
+        self.open()
+        if self.compress or self.backup_count is not None:
+            threading.Thread(target=self.finish_segment, args=(segment,), name='ndjson-rotate', daemon=True).start()
+
+    def finish_segment(self, segment):
+        with self.segment_lock:
+            self.compress_and_cleanup(segment)
+
+    def compress_and_cleanup(self, segment):
+        try:
+            if self.compress:
+                with open(segment, 'rb') as source, gzip.open(f'{segment}.gz', 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                os.remove(segment)
+            if self.backup_count is not None:
+                # segment names sort by time
+                segments = sorted(glob.glob(f'{glob.escape(self.path)}.*'))
+                for old_segment in segments[:max(len(segments) - self.backup_count, 0)]:
+                    os.remove(old_segment)
+        except OSError as e:
+            logger.error(f'NDJSON: could not finish segment {segment}: {e}')
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
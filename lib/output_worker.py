@@ -0,0 +1,145 @@
+import itertools
+import logging
+import threading
+import time
+from collections import OrderedDict
+import lib.metrics as metrics
+
+logger = logging.getLogger()
+
+DEFAULT_CAPACITY = 10000
+DEFAULT_POLICY = 'drop_oldest'
+DEFAULT_BATCH_SIZE = 100
+POLICIES = ('drop_oldest', 'coalesce', 'block')
+
+
+class OutputWorker:
+    """
+    Decouples the devices from the output: values are put into a bounded queue and published by one worker thread,
+    so a slow broker or syslog does not delay the bluetooth events or the serial reader.
+    If the queue is full, the policy decides:
+      drop_oldest: the oldest waiting value is dropped
+      coalesce: a waiting value of the same device and name is replaced (batches are merged), otherwise the oldest
+                waiting value is dropped
+      block: the device waits until the worker made room
+    """
+
+    def __init__(self, output, capacity=DEFAULT_CAPACITY, policy=DEFAULT_POLICY, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        :param output: Output function, called from the worker thread only
+        :param capacity: Maximum number of waiting values
+        :param policy: drop_oldest, coalesce or block
+        :param batch_size: Values taken from the queue at once
+        """
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown output queue policy {policy}, possible: {", ".join(POLICIES)}')
+        self.output = output
+        self.capacity = capacity
+        self.policy = policy
+        self.batch_size = batch_size
+        # sequence number -> (device name, category, value, vunit, monotonic time of enqueue), oldest first
+        self.pending = OrderedDict()
+        # (device name, category) -> sequence number of its newest waiting value, to coalesce
+        self.newest = {}
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        self.not_empty = threading.Condition(self.lock)
+        self.not_full = threading.Condition(self.lock)
+        self.keep_running = False
+        # set by stop(), values put afterwards are not published anymore
+        self.stopped = False
+        self.discarded = 0
+        self.thread = None
+        metrics.OUTPUT_QUEUE_DEPTH.labels().set_function(lambda: len(self.pending))
+
+    def start(self):
+        self.keep_running = True
+        self.thread = threading.Thread(target=self.run, name='output-worker', daemon=True)
+        self.thread.start()
+
+    def put(self, device_name, category, value, hass_config=False, vunit=None):
+        """
+        Same signature as the output functions
+        """
+        if hass_config:
+            # discovery configs come from the discovery thread and must not be dropped
+            return self.output(device_name, category, value, hass_config=True)
+
+        item = (device_name, category, value, vunit, time.monotonic())
+        with self.lock:
+            if self.stopped:
+                self.discard(device_name, category)
+                return
+            if len(self.pending) >= self.capacity:
+                if self.policy == 'coalesce' and (device_name, category) in self.newest:
+                    key = self.newest[(device_name, category)]
+                    waiting = self.pending[key]
+                    if category is None:
+                        # a batch: the values of the newer batch win
+                        value = {**waiting[2], **value}
+                    # the wait is measured from the oldest value of the entry
+                    self.pending[key] = (device_name, category, value, vunit, waiting[4])
+                    metrics.OUTPUT_COALESCED.labels(device_name).inc()
+                    return
+                if self.policy == 'block':
+                    while len(self.pending) >= self.capacity and not self.stopped:
+                        self.not_full.wait()
+                    if self.stopped:
+                        self.discard(device_name, category)
+                        return
+                else:
+                    dropped = self.forget(*self.pending.popitem(last=False))
+                    metrics.OUTPUT_DROPPED.labels(dropped[0]).inc()
+            key = next(self.sequence)
+            self.pending[key] = item
+            self.newest[(device_name, category)] = key
+            self.not_empty.notify()
+
+    def forget(self, key, item):
+        """
+        Removes a value taken from the queue from the coalesce index, unless a newer one of the same name waits
+        :return: The value
+        """
+        if self.newest.get(item[:2]) == key:
+            del self.newest[item[:2]]
+        return item
+
+    def discard(self, device_name, category):
+        """
+        Drops a value put after stop(), logged once, the devices may still be running at exit
+        """
+        metrics.OUTPUT_DROPPED.labels(device_name).inc()
+        if not self.discarded:
+            logger.warning(f'{device_name}: Output stopped, {category} and all following values are dropped')
+        self.discarded += 1
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.pending and self.keep_running:
+                    self.not_empty.wait()
+                if not self.pending:
+                    return
+                batch = [self.forget(*self.pending.popitem(last=False)) for _ in range(min(self.batch_size, len(self.pending)))]
+                self.not_full.notify_all()
+
+            for device_name, category, value, vunit, enqueued in batch:
+                start = time.monotonic()
+                metrics.OUTPUT_QUEUE_WAIT.labels(device_name).observe(start - enqueued)
+                try:
+                    self.output(device_name, category, value, vunit=vunit)
+                except Exception:
+                    logger.exception(f'{device_name}: Output of {category} failed')
+                metrics.PUBLISH_LATENCY.labels(device_name).observe(time.monotonic() - start)
+
+    def stop(self):
+        """
+        Publishes the waiting values and stops the worker
+        """
+        with self.lock:
+            self.keep_running = False
+            self.stopped = True
+            self.not_empty.notify()
+            self.not_full.notify_all()
+        if self.thread is not None:
+            self.thread.join()
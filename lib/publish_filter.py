@@ -0,0 +1,51 @@
+import logging
+import time
+
+logger = logging.getLogger()
+
+
+class PublishFilter:
+    """
+    Decides per value name if a value is published or suppressed.
+    Unchanged values are suppressed, numbers also if they changed less than the deadband of the value.
+    After heartbeat seconds without a publish, a value is published even if it did not change.
+    """
+
+    def __init__(self, filter_config):
+        """
+        :param filter_config: publish_filter section of one device:
+            {'heartbeat': seconds, 'values': {value name: {'deadband': x, 'deadband_relative': x, 'heartbeat': x}}}
+        """
+        self.heartbeat = filter_config.get('heartbeat')
+        self.values_config = filter_config.get('values') or {}
+        # value name -> (last published value, time of publish)
+        self.published = {}
+        self.suppressed = 0
+
+    def should_publish(self, name, value, now=None):
+        """
+        :param name: Value name or collection name
+        :param value: Value, for collections a dict {value name: value}
+        :return: True if the value must be published, it is then remembered as last published value
+        """
+        if now is None:
+            now = time.monotonic()
+        last = self.published.get(name)
+        if last is not None and not self.changed(name, last[0], value):
+            value_config = self.values_config.get(name, {})
+            heartbeat = value_config.get('heartbeat', self.heartbeat)
+            if heartbeat is None or now - last[1] < heartbeat:
+                self.suppressed += 1
+                return False
+        self.published[name] = (value, now)
+        return True
+
+    def changed(self, name, last, value):
+        if type(value) in (int, float) and type(last) in (int, float):
+            value_config = self.values_config.get(name, {})
+            difference = abs(value - last)
+            if 'deadband' in value_config:
+                return difference >= value_config['deadband']
+            if 'deadband_relative' in value_config:
+                return difference > abs(last) * value_config['deadband_relative']
+        return value != last
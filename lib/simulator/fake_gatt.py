@@ -0,0 +1,255 @@
+"""
+In-process stand-in for the gatt module (DeviceManager, Device, Service, Characteristic).
+After install() the bluetooth drivers import this module as gatt and connect to simulated devices, which answer reads
+and send notifications from recorded patterns. All events run on the loop of the DeviceManager, like the GLib main loop.
+"""
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+import types
+
+logger = logging.getLogger()
+
+# mac address (lower case) -> DeviceProfile
+profiles = {}
+
+
+class DeviceProfile:
+    """
+    Services and value patterns of a simulated device
+    """
+
+    def __init__(self, services, reads=None, notifications=None, notify_rate=20.0):
+        """
+        :param services: {service uuid: [characteristic uuid, ...]}
+        :param reads: {characteristic uuid: [value, ...]}, every read returns the next value
+        :param notifications: [(characteristic uuid, value), ...], sent in a loop for the enabled characteristics
+        :param notify_rate: Notifications per second
+        """
+        self.services = services
+        self.reads = reads or {}
+        self.notifications = notifications or []
+        self.notify_interval = 1 / notify_rate
+
+
+def register_device(mac_address, profile):
+    profiles[mac_address.lower()] = profile
+
+
+def install():
+    """
+    Installs this module as gatt, a no-op dbus main loop and GLib.timeout_add on the loop of the DeviceManager,
+    must run before the bluetooth drivers are imported
+    """
+    module = sys.modules[__name__]
+    dbus = types.ModuleType('dbus')
+    dbus.mainloop = types.ModuleType('dbus.mainloop')
+    dbus.mainloop.glib = types.ModuleType('dbus.mainloop.glib')
+    dbus.mainloop.glib.threads_init = lambda: None
+    gi = types.ModuleType('gi')
+    gi.repository = types.ModuleType('gi.repository')
+    gi.repository.GLib = types.SimpleNamespace(timeout_add=timeout_add)
+    sys.modules.update({
+        'gatt': module,
+        'gatt.gatt_linux': module,
+        'dbus': dbus,
+        'dbus.mainloop': dbus.mainloop,
+        'dbus.mainloop.glib': dbus.mainloop.glib,
+        'gi': gi,
+        'gi.repository': gi.repository,
+    })
+
+
+def timeout_add(interval, function, *args):
+    """
+    GLib.timeout_add on the loop of the last created DeviceManager, function runs again as long as it returns True
+    :param interval: Milliseconds
+    """
+    def run():
+        if function(*args):
+            DeviceManager.default.schedule(interval / 1000, run)
+
+    DeviceManager.default.schedule(interval / 1000, run)
+
+
+class DeviceManager:
+    # the loop timeout_add schedules on, like the default GLib main context
+    default = None
+
+    def __init__(self, adapter_name='hci0'):
+        self.adapter_name = adapter_name
+        self.condition = threading.Condition()
+        self.events = []
+        self.sequence = itertools.count()
+        self.keep_running = True
+        DeviceManager.default = self
+
+    def schedule(self, delay, function, *args):
+        with self.condition:
+            heapq.heappush(self.events, (time.monotonic() + delay, next(self.sequence), function, args))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.keep_running and (not self.events or self.events[0][0] > time.monotonic()):
+                    self.condition.wait(self.events[0][0] - time.monotonic() if self.events else None)
+                if not self.keep_running:
+                    return
+                _, _, function, args = heapq.heappop(self.events)
+            try:
+                function(*args)
+            except Exception:
+                logger.exception(f'Simulated gatt: event {function.__name__} failed')
+
+    def stop(self):
+        with self.condition:
+            self.keep_running = False
+            self.condition.notify()
+
+    def start_discovery(self, service_uuids=None):
+        pass
+
+    def stop_discovery(self):
+        pass
+
+
+class Device:
+    # Seconds from connect to resolved services
+    RESOLVE_DELAY = 0.1
+
+    def __init__(self, mac_address, manager, managed=True):
+        self.mac_address = mac_address
+        self.manager = manager
+        self.profile = profiles.get(mac_address.lower())
+        self.services = []
+        self.notifying = set()
+        self.notification_index = 0
+        self._connected = False
+
+    def connect(self):
+        if self.profile is None:
+            self.connect_failed(Exception(f'No simulated device with mac address {self.mac_address}'))
+            return
+        self._connected = True
+        self.services = [Service(self, uuid, characteristic_uuids)
+                         for uuid, characteristic_uuids in self.profile.services.items()]
+        self.connect_succeeded()
+        self.manager.schedule(self.RESOLVE_DELAY, self.resolve)
+
+    def resolve(self):
+        if self._connected:
+            self.services_resolved()
+
+    def disconnect(self):
+        self.manager.schedule(0, self.finish_disconnect)
+
+    def finish_disconnect(self):
+        if self._connected:
+            self._connected = False
+            self.notifying.clear()
+            self.disconnect_succeeded()
+
+    def is_connected(self):
+        return self._connected
+
+    def characteristic(self, uuid):
+        for service in self.services:
+            for characteristic in service.characteristics:
+                if characteristic.uuid == uuid:
+                    return characteristic
+
+    def enable_notifications(self, characteristic, enabled):
+        was_notifying = bool(self.notifying)
+        if enabled:
+            self.notifying.add(characteristic.uuid)
+        else:
+            self.notifying.discard(characteristic.uuid)
+        if self.notifying and not was_notifying:
+            self.manager.schedule(self.profile.notify_interval, self.notify)
+
+    def notify(self):
+        """
+        Sends the next notification of an enabled characteristic and schedules the following one
+        """
+        if not self._connected or not self.notifying:
+            return
+        notifications = self.profile.notifications
+        for _ in range(len(notifications)):
+            uuid, value = notifications[self.notification_index]
+            self.notification_index = (self.notification_index + 1) % len(notifications)
+            if uuid in self.notifying:
+                self.characteristic_value_updated(self.characteristic(uuid), value)
+                break
+        self.manager.schedule(self.profile.notify_interval, self.notify)
+
+    # Event handlers, overridden by the drivers
+    def connect_succeeded(self):
+        pass
+
+    def connect_failed(self, error):
+        pass
+
+    def disconnect_succeeded(self):
+        pass
+
+    def services_resolved(self):
+        pass
+
+    def characteristic_value_updated(self, characteristic, value):
+        pass
+
+    def characteristic_read_value_failed(self, characteristic, error):
+        pass
+
+    def characteristic_write_value_succeeded(self, characteristic):
+        pass
+
+    def characteristic_write_value_failed(self, characteristic, error):
+        pass
+
+    def characteristic_enable_notifications_succeeded(self, characteristic):
+        pass
+
+    def characteristic_enable_notifications_failed(self, characteristic, error):
+        pass
+
+
+class Service:
+    def __init__(self, device, uuid, characteristic_uuids):
+        self.device = device
+        self.uuid = uuid
+        self.characteristics = [Characteristic(self, characteristic_uuid) for characteristic_uuid in characteristic_uuids]
+
+
+class Characteristic:
+    def __init__(self, service, uuid):
+        self.service = service
+        self.uuid = uuid
+        self.reads = 0
+
+    def __repr__(self):
+        return f'<Characteristic {self.uuid}>'
+
+    def read_value(self, offset=0):
+        device = self.service.device
+        values = device.profile.reads.get(self.uuid)
+        if not values:
+            device.manager.schedule(0, device.characteristic_read_value_failed, self, Exception('Not readable'))
+            return
+        value = values[self.reads % len(values)]
+        self.reads += 1
+        device.manager.schedule(0, device.characteristic_value_updated, self, value)
+
+    def write_value(self, value, offset=0):
+        device = self.service.device
+        device.manager.schedule(0, device.characteristic_write_value_succeeded, self)
+
+    def enable_notifications(self, enabled=True):
+        device = self.service.device
+        device.enable_notifications(self, enabled)
+        if enabled:
+            device.manager.schedule(0, device.characteristic_enable_notifications_succeeded, self)
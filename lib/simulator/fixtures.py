@@ -0,0 +1,29 @@
+import os
+
+# Synthetic device data for the simulator, the benchmarks and the tests, see fixtures/README.md
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def load_hex_lines(name):
+    """
+    Loads a fixture with one hex encoded packet per line, lines starting with # are comments
+    :param name: Filename in fixtures directory
+    :return: List of bytes
+    """
+    with open(os.path.join(FIXTURES, name), 'r') as fixture:
+        return [bytes.fromhex(line.strip()) for line in fixture if line.strip() and not line.startswith('#')]
+
+
+def load_characteristic_reads(name):
+    """
+    Loads a fixture with one characteristic read per line: "<uuid> <value as hex>"
+    :param name: Filename in fixtures directory
+    :return: List of (uuid, bytes)
+    """
+    reads = []
+    with open(os.path.join(FIXTURES, name), 'r') as fixture:
+        for line in fixture:
+            if line.strip() and not line.startswith('#'):
+                uuid, value = line.split()
+                reads.append((uuid, bytes.fromhex(value)))
+    return reads
@@ -0,0 +1,146 @@
+import argparse
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+import yaml
+
+logger = logging.getLogger()
+
+# Service of the BLE characteristics and of the characteristics of the old bluetooth protocol
+BLE_SERVICE = '65970000-4bda-4c1e-af4b-551c4cf74769'
+BLUETOOTH_SERVICE = '306b0001-b081-4037-83dc-e59fcc3cdfd0'
+
+# Simulators must live as long as the process
+simulators = []
+
+
+def parse_count(text):
+    """
+    :param text: TYPE=COUNT, e.g. smartshunt=10
+    :return: (type, count)
+    """
+    device_type, _, count = text.partition('=')
+    return device_type, int(count or 1)
+
+
+def load_patterns(capture_file, default_protocol):
+    """
+    :param capture_file: Capture recorded with --record, None uses the fixtures
+    :param default_protocol: Protocol of the fixtures
+    :return: (protocol, {uuid: [value, ...]}, [(uuid, value), ...])
+    """
+    if capture_file is not None:
+        from lib.capture import read_capture, KIND_CHARACTERISTIC
+        device_config, records = read_capture(capture_file)
+        protocol = device_config['protocol']
+        notifications = [(uuid, data) for _, kind, uuid, data in records if kind == KIND_CHARACTERISTIC]
+    else:
+        from lib.simulator.fixtures import load_characteristic_reads, load_hex_lines
+        from lib.victron_bluetooth.victron_smartshunt import Smartshunt
+        protocol = default_protocol
+        if protocol == 'bluetooth-ble':
+            notifications = load_characteristic_reads('ble_characteristics.txt')
+        else:
+            notifications = [(Smartshunt.handle_uuid_map['0027'], value)
+                             for value in load_hex_lines('bulk_notifications.hex')]
+    reads = {}
+    for uuid, value in notifications:
+        reads.setdefault(uuid, []).append(value)
+    return protocol, reads, notifications
+
+
+def build_profile(protocol, reads, notifications, notify_rate):
+    from lib.simulator.fake_gatt import DeviceProfile
+    from lib.victron_ble.victron_gatt_ble import KEEP_ALIVE_FOREVER
+    if protocol == 'bluetooth-ble':
+        from lib.victron_ble.victron_smartshunt_ble import SmartshuntBLE
+        characteristics = list(SmartshuntBLE.MAP) + list(SmartshuntBLE.keep_alive_handle_uuid_map.values())
+        services = {BLE_SERVICE: characteristics}
+        reads = dict(reads)
+        for uuid in SmartshuntBLE.keep_alive_handle_uuid_map.values():
+            reads.setdefault(uuid, [KEEP_ALIVE_FOREVER.to_bytes(2, 'little')])
+    else:
+        from lib.victron_bluetooth.victron_smartshunt import Smartshunt
+        services = {BLUETOOTH_SERVICE: list(dict.fromkeys(Smartshunt.handle_uuid_map.values()))}
+    return DeviceProfile(services, reads=reads, notifications=notifications, notify_rate=notify_rate)
+
+
+def setup_simulation(argv, config):
+    """
+    Command line: victron.py simulate [--serial TYPE=COUNT] [--ble COUNT] [--bluetooth COUNT] [...]
+    Starts the simulated devices and writes a config with all of them
+    :param argv: Arguments after "simulate"
+    :param config: Loaded config, all sections except the devices are used for the simulation
+    :return: Arguments for victron.py to run all simulated devices
+    """
+    parser = argparse.ArgumentParser(prog='victron.py simulate',
+                                     description='Run simulated devices through the real pipeline (load test). '
+                                                 'Unknown arguments are passed on to victron.py, e.g. -c or --quiet')
+    parser.add_argument('--serial', action='append', default=[], type=parse_count, metavar='TYPE=COUNT',
+                        help='VE.Direct devices on pseudo-terminals, TYPE: phoenix, smartshunt or smartsolar')
+    parser.add_argument('--ble', type=int, default=0, metavar='COUNT', help='Smart Shunts with bluetooth-ble')
+    parser.add_argument('--bluetooth', type=int, default=0, metavar='COUNT', help='Smart Shunts with bluetooth')
+    parser.add_argument('--streaming', action='store_true', help='bluetooth-ble devices stay connected')
+    parser.add_argument('--rate', type=float, default=1.0, help='VE.Direct blocks per second [Default: 1]')
+    parser.add_argument('--notify-rate', type=float, default=20.0,
+                        help='Notifications per second of a bluetooth device [Default: 20]')
+    parser.add_argument('--fields', help='Comma separated VE.Direct keys to send [Default: all]')
+    parser.add_argument('--capture', action='append', default=[],
+                        help='Replay a capture recorded with --record instead of the fixtures, per protocol')
+    parser.add_argument('--logger', help='Output of the simulation [Default: logger from config]')
+    parser.add_argument('-C', '--config-file', help='Config for everything except devices [Default: config.yml]')
+    args, victron_argv = parser.parse_known_args(argv)
+
+    if args.config_file:
+        with open(args.config_file, 'r') as ymlfile:
+            config = yaml.full_load(ymlfile)
+    config = dict(config or {})
+    config.setdefault('timer', {'retry': 15, 'bluetooth-ble': {'repeat': 60}, 'serial': {'repeat': 30}})
+    if args.logger:
+        config['logger'] = args.logger
+    config.setdefault('logger', 'print')
+
+    devices = []
+    fields = args.fields.split(',') if args.fields else None
+    for device_type, count in args.serial:
+        from lib.simulator.vedirect import VedirectSimulator
+        for number in range(1, count + 1):
+            simulator = VedirectSimulator(device_type, rate=args.rate, fields=fields, seed=len(devices))
+            simulator.start()
+            simulators.append(simulator)
+            devices.append({'name': f'Sim{device_type.capitalize()}{number}', 'type': device_type,
+                            'protocol': 'serial', 'port': simulator.port})
+
+    if args.ble or args.bluetooth:
+        from lib.simulator import fake_gatt
+        fake_gatt.install()
+        captures = {}
+        for capture_file in args.capture:
+            protocol, reads, notifications = load_patterns(capture_file, None)
+            captures[protocol] = (protocol, reads, notifications)
+        for protocol, count in (('bluetooth-ble', args.ble), ('bluetooth', args.bluetooth)):
+            if not count:
+                continue
+            profile = build_profile(*(captures.get(protocol) or load_patterns(None, protocol)), args.notify_rate)
+            for number in range(1, count + 1):
+                mac = f'02:00:00:00:{len(devices) >> 8:02x}:{len(devices) & 0xFF:02x}'
+                fake_gatt.register_device(mac, profile)
+                device = {'name': f'Sim{"Ble" if protocol == "bluetooth-ble" else "Bluetooth"}{number}',
+                          'type': 'smartshunt', 'protocol': protocol, 'mac': mac}
+                if protocol == 'bluetooth-ble' and args.streaming:
+                    device['streaming'] = True
+                devices.append(device)
+
+    if not devices:
+        parser.error('No devices to simulate, use --serial, --ble or --bluetooth')
+    config['devices'] = devices
+
+    directory = tempfile.mkdtemp(prefix='victron-simulation-')
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    config_file = os.path.join(directory, 'config.yml')
+    with open(config_file, 'w') as ymlfile:
+        yaml.safe_dump(config, ymlfile)
+    logger.info(f'Simulating {len(devices)} devices, config: {config_file}')
+    return ['-C', config_file, '-a'] + victron_argv
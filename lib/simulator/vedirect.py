@@ -0,0 +1,130 @@
+import errno
+import logging
+import os
+import random
+import threading
+import time
+import tty
+
+logger = logging.getLogger()
+
+# Blocks sent by the devices, taken from the sample packets in lib/victron_serial/victron_*.py
+# TYPE: [[(KEY, VALUE), ...], ...], the blocks are sent one after another
+BLOCKS = {
+    'phoenix': [
+        [('PID', '0xA261'), ('FW', '0114'), ('SER#', 'HQ1936HGQYH'), ('MODE', '2'), ('CS', '9'), ('AC_OUT_V', '23004'),
+         ('AC_OUT_I', '-3'), ('V', '13232'), ('AR', '0'), ('WARN', '0')],
+    ],
+    'smartshunt': [
+        [('PID', '0xA389'), ('V', '13259'), ('VS', '12716'), ('I', '-7742'), ('P', '-103'), ('CE', '-2911'),
+         ('SOC', '990'), ('TTG', '2052'), ('Alarm', 'OFF'), ('AR', '0'), ('BMV', 'SmartShunt 500A/50mV'),
+         ('FW', '0407'), ('MON', '0')],
+        [('H1', '-264148'), ('H2', '-2909'), ('H3', '-109417'), ('H4', '6'), ('H5', '1'), ('H6', '-3928992'),
+         ('H7', '6200'), ('H8', '14592'), ('H9', '3331'), ('H10', '21'), ('H11', '0'), ('H12', '0'), ('H15', '-27'),
+         ('H16', '14592'), ('H17', '5148'), ('H18', '5581')],
+    ],
+    'smartsolar': [
+        [('PID', '0xA056'), ('FW', '156'), ('SER#', 'HQ2027LDKCU'), ('V', '13330'), ('I', '5800'), ('VPV', '81010'),
+         ('PPV', '80'), ('CS', '3'), ('MPPT', '2'), ('OR', '0x00000000'), ('ERR', '0'), ('LOAD', 'ON'),
+         ('H19', '26518'), ('H20', '8'), ('H21', '79'), ('H22', '67'), ('H23', '267'), ('HSDS', '358')],
+    ],
+}
+
+# Measured values vary in every block by up to this fraction
+VARIATION = {
+    'V': 0.002,
+    'VS': 0.002,
+    'I': 0.05,
+    'P': 0.05,
+    'CE': 0.001,
+    'VPV': 0.01,
+    'PPV': 0.05,
+    'AC_OUT_V': 0.005,
+    'AC_OUT_I': 0.2,
+}
+
+
+def encode_block(fields):
+    """
+    :param fields: List of (key, value)
+    :return: VE.Direct text block with checksum, the sum of all bytes of the block is 0 (mod 256)
+    """
+    block = b''.join(b'\r\n' + key.encode('ascii') + b'\t' + value.encode('ascii') for key, value in fields)
+    block += b'\r\nChecksum\t'
+    return block + bytes([-sum(block) % 256])
+
+
+class VedirectSimulator:
+    """
+    Sends the VE.Direct text protocol of a device on a pseudo-terminal.
+    The port of the simulator can be used as serial port of a device in the config.
+    If nobody reads the port, blocks are dropped like on a real device.
+    """
+
+    def __init__(self, device_type, rate=1.0, fields=None, seed=None):
+        """
+        :param device_type: phoenix, smartshunt or smartsolar
+        :param rate: Blocks per second
+        :param fields: List of keys to send, None sends all keys of the device
+        :param seed: Seed for the variation of the values
+        """
+        if device_type not in BLOCKS:
+            raise ValueError(f'No VE.Direct simulation for device type {device_type}')
+        self.device_type = device_type
+        self.interval = 1 / rate
+        self.blocks = [[(key, value) for key, value in block if fields is None or key in fields]
+                       for block in BLOCKS[device_type]]
+        self.blocks = [block for block in self.blocks if block]
+        self.random = random.Random(seed)
+        self.master, self.slave = os.openpty()
+        # no translation of \r\n on the slave side
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self.keep_running = False
+        self.thread = None
+        self.sent = 0
+        self.dropped = 0
+
+    def vary(self, key, value):
+        if key not in VARIATION:
+            return value
+        variation = VARIATION[key]
+        return str(round(int(value) * (1 + self.random.uniform(-variation, variation))))
+
+    def start(self):
+        self.keep_running = True
+        self.thread = threading.Thread(target=self.run, name=f'simulator-{os.path.basename(self.port)}', daemon=True)
+        self.thread.start()
+
+    def run(self):
+        next_time = time.monotonic()
+        while self.keep_running:
+            for block in self.blocks:
+                self.write(encode_block([(key, self.vary(key, value)) for key, value in block]))
+                next_time += self.interval
+                delay = next_time - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # too slow for the rate, do not try to catch up
+                    next_time = time.monotonic()
+                if not self.keep_running:
+                    break
+
+    def write(self, data):
+        try:
+            os.write(self.master, data)
+            self.sent += 1
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+            self.dropped += 1
+
+    def stop(self):
+        self.keep_running = False
+        if self.thread is not None:
+            self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+        logger.info(f'VE.Direct simulator {self.port}: sent {self.sent} blocks, dropped {self.dropped}')
@@ -0,0 +1,246 @@
+import argparse
+import atexit
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger()
+
+DEFAULT_PATH = 'data/victron.sqlite'
+DEFAULT_RETENTION_DAYS = 7
+DEFAULT_ROLLUP_RETENTION_DAYS = 365
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 10
+# Old rows are deleted at most once per hour
+CLEANUP_INTERVAL = 3600
+
+# rollup table -> bucket length in seconds
+ROLLUPS = {
+    'rollup_1m': 60,
+    'rollup_1h': 3600,
+}
+RESOLUTIONS = {
+    'raw': 'readings',
+    '1m': 'rollup_1m',
+    '1h': 'rollup_1h',
+}
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS readings (device TEXT NOT NULL, key TEXT NOT NULL, time REAL NOT NULL, '
+    'value REAL, text TEXT)',
+    'CREATE INDEX IF NOT EXISTS readings_device_key_time ON readings (device, key, time)',
+    'CREATE INDEX IF NOT EXISTS readings_time ON readings (time)',
+] + [
+    f'CREATE TABLE IF NOT EXISTS {table} (device TEXT NOT NULL, key TEXT NOT NULL, bucket INTEGER NOT NULL, '
+    f'min REAL, max REAL, sum REAL, count INTEGER, PRIMARY KEY (device, key, bucket)) WITHOUT ROWID'
+    for table in ROLLUPS
+]
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(store_config):
+    """
+    Returns the store shared by all devices of this process, created and started on first call
+    :param store_config: store section of the config
+    :return: ReadingStore
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ReadingStore(store_config.get('path', DEFAULT_PATH),
+                                  retention_days=store_config.get('retention_days', DEFAULT_RETENTION_DAYS),
+                                  rollup_retention_days=store_config.get('rollup_retention_days',
+                                                                         DEFAULT_ROLLUP_RETENTION_DAYS),
+                                  batch_size=store_config.get('batch_size', DEFAULT_BATCH_SIZE),
+                                  flush_interval=store_config.get('flush_interval', DEFAULT_FLUSH_INTERVAL))
+            _store.start()
+            # write the pending readings on exit
+            atexit.register(_store.stop)
+    return _store
+
+
+def connect(path):
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.commit()
+    return connection
+
+
+class ReadingStore:
+    """
+    Keeps all readings in a SQLite database in WAL mode.
+    Readings are collected in memory and inserted in batches by a writer thread, together with min/max/sum/count
+    rollups per minute and per hour. Raw readings are deleted after retention_days, rollups after
+    rollup_retention_days.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, retention_days=DEFAULT_RETENTION_DAYS,
+                 rollup_retention_days=DEFAULT_ROLLUP_RETENTION_DAYS, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.retention_days = retention_days
+        self.rollup_retention_days = rollup_retention_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.keep_running = False
+        self.thread = None
+        self.last_cleanup = 0
+        self.written = 0
+
+    def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.keep_running = True
+        self.thread = threading.Thread(target=self.run, name='store-writer', daemon=True)
+        self.thread.start()
+
+    def add(self, device, key, value, timestamp=None):
+        """
+        Called from the output path, only appends to the pending batch
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self.lock:
+            self.pending.append((device, key, timestamp, value))
+            if len(self.pending) >= self.batch_size:
+                self.wakeup.set()
+
+    def run(self):
+        connection = connect(self.path)
+        try:
+            while self.keep_running:
+                self.wakeup.wait(self.flush_interval)
+                self.wakeup.clear()
+                self.write(connection)
+            self.write(connection)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.keep_running = False
+        self.wakeup.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def write(self, connection):
+        with self.lock:
+            readings, self.pending = self.pending, []
+        now = time.time()
+        try:
+            if readings:
+                self.insert(connection, readings)
+            if now - self.last_cleanup >= CLEANUP_INTERVAL:
+                self.cleanup(connection, now)
+                self.last_cleanup = now
+        except sqlite3.Error as e:
+            logger.error(f'Store: could not write {len(readings)} readings to {self.path}: {e}')
+
+    def insert(self, connection, readings):
+        rows = []
+        rollups = {table: {} for table in ROLLUPS}
+        for device, key, timestamp, value in readings:
+            if type(value) in (int, float):
+                rows.append((device, key, timestamp, value, None))
+                for table, length in ROLLUPS.items():
+                    bucket = int(timestamp // length * length)
+                    current = rollups[table].get((device, key, bucket))
+                    if current is None:
+                        rollups[table][(device, key, bucket)] = [value, value, value, 1]
+                    else:
+                        current[0] = min(current[0], value)
+                        current[1] = max(current[1], value)
+                        current[2] += value
+                        current[3] += 1
+            else:
+                rows.append((device, key, timestamp, None, str(value)))
+
+        with connection:
+            connection.executemany('INSERT INTO readings (device, key, time, value, text) VALUES (?, ?, ?, ?, ?)', rows)
+            for table, buckets in rollups.items():
+                connection.executemany(
+                    f'INSERT INTO {table} (device, key, bucket, min, max, sum, count) VALUES (?, ?, ?, ?, ?, ?, ?) '
+                    f'ON CONFLICT (device, key, bucket) DO UPDATE SET min = min(min, excluded.min), '
+                    f'max = max(max, excluded.max), sum = sum + excluded.sum, count = count + excluded.count',
+                    [(*bucket_key, *values) for bucket_key, values in buckets.items()])
+        self.written += len(rows)
+
+    def cleanup(self, connection, now):
+        with connection:
+            connection.execute('DELETE FROM readings WHERE time < ?', (now - self.retention_days * 86400,))
+            for table in ROLLUPS:
+                connection.execute(f'DELETE FROM {table} WHERE bucket < ?', (now - self.rollup_retention_days * 86400,))
+
+
+def query(path, device, key, start, end, resolution='raw'):
+    """
+    :param path: Database file
+    :param device: Name of device
+    :param key: Value name, e.g. Voltage
+    :param start: Unix time
+    :param end: Unix time
+    :param resolution: raw, 1m or 1h
+    :return: raw: List of (time, value), rollups: List of (time, min, max, mean, count)
+    """
+    table = RESOLUTIONS[resolution]
+    connection = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        if table == 'readings':
+            return connection.execute(
+                'SELECT time, coalesce(value, text) FROM readings '
+                'WHERE device = ? AND key = ? AND time >= ? AND time < ? ORDER BY time',
+                (device, key, start, end)).fetchall()
+        return connection.execute(
+            f'SELECT bucket, min, max, sum / count, count FROM {table} '
+            f'WHERE device = ? AND key = ? AND bucket >= ? AND bucket < ? ORDER BY bucket',
+            (device, key, start, end)).fetchall()
+    finally:
+        connection.close()
+
+
+def query_command(argv, config):
+    """
+    Command line: victron.py query -d DEVICE -k KEY [--from TIME] [--to TIME] [-r raw|1m|1h] [-C CONFIG | -p PATH]
+    :param config: config.yml of the working directory, None if missing
+    """
+    parser = argparse.ArgumentParser(prog='victron.py query', description='Query stored readings')
+    parser.add_argument('-d', '--device', required=True, help='Name of device')
+    parser.add_argument('-k', '--key', required=True, help='Value name, e.g. Voltage')
+    parser.add_argument('--from', dest='start', type=datetime.fromisoformat,
+                        help='Start time, e.g. 2024-05-01T12:00 [Default: 24 hours ago]')
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat, help='End time [Default: now]')
+    parser.add_argument('-r', '--resolution', choices=list(RESOLUTIONS), default='raw')
+    parser.add_argument('-p', '--path', help='Database file [Default: store path from config]')
+    parser.add_argument('-C', '--config-file', help='Config file with the store path [Default: config.yml]')
+    args = parser.parse_args(argv)
+
+    if args.config_file:
+        import yaml
+        with open(args.config_file, 'r') as ymlfile:
+            config = yaml.full_load(ymlfile)
+    path = args.path or ((config or {}).get('store') or {}).get('path', DEFAULT_PATH)
+    if not os.path.exists(path):
+        print(f'Database {path} not found, set the store path in the config or use -p')
+        sys.exit(1)
+    end = args.end or datetime.now()
+    start = args.start or end - timedelta(hours=24)
+    try:
+        rows = query(path, args.device, args.key, start.timestamp(), end.timestamp(), args.resolution)
+    except sqlite3.Error as e:
+        print(f'Could not query {path}: {e}')
+        sys.exit(1)
+    for row in rows:
+        timestamp = f'{datetime.fromtimestamp(row[0]):%Y-%m-%d %H:%M:%S}'
+        print('\t'.join([timestamp] + [str(column) for column in row[1:]]))
@@ -0,0 +1,47 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+class Supervisor:
+    """
+    Runs every configured device in its own worker thread of one process.
+    A device which crashed is restarted after the retry timer, the other devices keep running.
+    """
+
+    def __init__(self, devices_config, start_device, retry):
+        """
+        :param devices_config: List of device configs
+        :param start_device: Function(thread_count, device_config), blocks as long as the device is running
+        :param retry: Seconds to wait before a crashed device is restarted
+        """
+        self.devices_config = devices_config
+        self.start_device = start_device
+        self.retry = retry
+        self.workers = {}
+
+    def start(self):
+        for count, device_config in enumerate(self.devices_config, start=1):
+            worker = threading.Thread(target=self.run_device,
+                                      args=(count, device_config),
+                                      name=device_config['name'],
+                                      daemon=True)
+            self.workers[device_config['name']] = worker
+            worker.start()
+            logger.debug(f'{device_config["name"]}: Worker started')
+
+    def run_device(self, thread_count, device_config):
+        while True:
+            try:
+                self.start_device(thread_count, device_config)
+                logger.info(f'{device_config["name"]}: Worker finished')
+                return
+            except Exception:
+                logger.exception(f'{device_config["name"]}: Worker crashed, restarting in {self.retry} seconds')
+                time.sleep(self.retry)
+
+    def join(self):
+        for worker in self.workers.values():
+            worker.join()
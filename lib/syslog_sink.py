@@ -0,0 +1,74 @@
+import logging
+import os
+import socket
+import threading
+from datetime import datetime, timezone
+
+logger = logging.getLogger()
+
+DEFAULT_ADDRESS = '/dev/log'
+DEFAULT_PORT = 514
+# facility user (1), severity informational (6)
+DEFAULT_PRIORITY = 1 * 8 + 6
+NILVALUE = '-'
+
+
+class SyslogSink:
+    """
+    Sends messages in RFC 5424 format over one datagram socket, which stays open for the whole runtime.
+    The socket is either the local syslog socket (/dev/log) or UDP to a remote syslog server.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, port=DEFAULT_PORT, app_name='victron', priority=DEFAULT_PRIORITY):
+        """
+        :param address: Path of a unix socket or hostname of a remote syslog server
+        :param port: UDP port of the remote syslog server
+        :param app_name: APP-NAME of the messages (tag of /usr/bin/logger)
+        :param priority: facility * 8 + severity
+        """
+        self.address = address
+        self.port = port
+        self.remote = not address.startswith('/')
+        # header fields do not change, only the timestamp is added per message
+        self.hostname = socket.gethostname() or NILVALUE
+        self.header = f'{self.hostname} {app_name} {os.getpid()} {NILVALUE} {NILVALUE} '
+        self.prefix = f'<{priority}>1 '
+        self.lock = threading.Lock()
+        self.sock = None
+        self.errors = 0
+
+    def connect(self):
+        if self.remote:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.connect((self.address, self.port))
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sock.connect(self.address)
+
+    def format(self, message):
+        timestamp = datetime.now(timezone.utc).isoformat(timespec='microseconds').replace('+00:00', 'Z')
+        return f'{self.prefix}{timestamp} {self.header}{message}'.encode('utf-8')
+
+    def send(self, message):
+        """
+        :param message: Text of the message, e.g. a single value or a whole collection as json
+        """
+        data = self.format(message)
+        with self.lock:
+            # reconnect once, e.g. if the syslog daemon was restarted
+            for attempt in range(2):
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    self.sock.send(data)
+                    return
+                except OSError as e:
+                    self.close()
+                    if attempt == 1:
+                        self.errors += 1
+                        logger.error(f'Syslog: could not send message to {self.address}: {e}')
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
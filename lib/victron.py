@@ -1,89 +1,286 @@
 import json
 import logging
+import os
+import threading
+import time
 import lib.helper as helper
+import lib.metrics as metrics
 from datetime import datetime, timedelta
 
 logger = logging.getLogger()
 
 
 class Victron:
-    def __init__(self, config, device_config, output, cmd, thread_count, thread_q):
+    def __init__(self, config, device_config, output, cmd, thread_count, thread_q, device_count=1):
         self.config = config
         self.device_config = device_config
-        self.given_output = output
         self.cmd = cmd
         self.thread_count = thread_count
+        # number of devices started, -a or several -d
+        self.device_count = device_count
+        # OutputWorker: values are published by its thread, the device does not wait for the output
         self.thread_q = thread_q
+        self.given_output = thread_q.put if thread_q is not None else output
         self.collections = None
         self.victron_type = None
+        self.publish_filter = None
+        # Batch: values of one frame are published as one json document on the device topic
+        self.batch = None
+        self.batch_lock = threading.Lock()
+        self.batch_timer = None
+        self.per_value_topics = False
+        self.values_decoded = metrics.VALUES_DECODED.labels(device_config['name'])
+        self.values_published = metrics.VALUES_PUBLISHED.labels(device_config['name'])
+        if self.config['logger'] == 'mqtt' and self.config['mqtt'].get('batch', False):
+            self.batch = {}
+            self.per_value_topics = self.config['mqtt'].get('per_value_topics', False)
 
+        self.store = None
+        if self.config.get('store') is not None:
+            from lib.store import get_store
+            self.store = get_store(self.config['store'])
+
+        filter_config = (self.config.get('publish_filter') or {}).get(device_config['name'])
+        if filter_config is not None:
+            from lib.publish_filter import PublishFilter
+            self.publish_filter = PublishFilter(filter_config)
+
+        # value name -> collection, a value is only set in the first collection which contains it
+        self.collection_index = {}
+        # collection -> number of values without value yet
+        self.collection_missing = {}
+        # Deadlines: a partial collection is published flush seconds after its last publish,
+        # values older than max_age seconds are removed from the collection
+        collection_timer = self.config.get('timer', {}).get('collections') or {}
+        self.collection_flush = collection_timer.get('flush')
+        self.collection_max_age = collection_timer.get('max_age')
+        # collection -> {value name: time of update}
+        self.collection_updated = {}
+        self.collection_deadline = {}
+        self.next_collection_deadline = None
+        # the deadlines are checked by a timer, also while the device sends nothing
+        self.collection_lock = threading.Lock()
+        self.collection_timer = None
+        self.closed = False
         if self.cmd.collection:
             if device_config['name'] in self.config['collections']:
                 self.collections = {}
                 for collection in self.config['collections'][device_config['name']].keys():
                     self.reset_collection(collection)
+                    for value_name in self.collections[collection]:
+                        self.collection_index.setdefault(value_name, collection)
+                if self.collection_flush:
+                    now = time.monotonic()
+                    for collection in self.collections:
+                        self.collection_deadline[collection] = now + self.collection_flush
+                    self.next_collection_deadline = now + self.collection_flush
+                    self.schedule_collection_deadline(now)
 
         if self.device_config['protocol'] == 'serial':
             from lib.victron_serial.victron_serial import VictronSerial
-            self.victron_type = VictronSerial(device_config, self.output)
+            self.victron_type = VictronSerial(device_config, self.output, self.flush)
         elif self.device_config['protocol'] == 'bluetooth-ble':
             from lib.victron_ble.victron_ble import VictronBle
-            self.victron_type = VictronBle(device_config, self.output)
+            self.victron_type = VictronBle(device_config, self.output, self.flush)
         elif self.device_config['protocol'] == 'bluetooth':
             from lib.victron_bluetooth.victron_bluetooth import VictronBluetooth
-            self.victron_type = VictronBluetooth(device_config, self.output)
+            self.victron_type = VictronBluetooth(device_config, self.output, self.flush)
 
         if self.victron_type is None:
             logger.error(f"{self.device_config['name']}: Missing or unknown device type")
+        elif getattr(self.cmd, 'record', None):
+            self.start_recording(self.cmd.record)
 
         if self.config['logger'] == 'mqtt' and self.config['mqtt']['hass']:
-            pid, ser, fw = self.victron_type.get_device_info()
-            mapping_table = self.victron_type.get_mapping_table()
-            helper.send_hass_config_payload(self.device_config['name'],
-                                            pid,
-                                            ser,
-                                            fw,
-                                            mapping_table,
-                                            self.config['mqtt']['base_topic'],
-                                            self.given_output,
-                                            self.collections)
+            # get_device_info may wait for the first packet, the values must not wait for the discovery
+            threading.Thread(target=self.send_hass_discovery,
+                             name=f'{self.device_config["name"]}-hass',
+                             daemon=True).start()
+
+    def start_recording(self, path):
+        """
+        :param path: Capture file, with several devices the name of the device is added
+        """
+        import atexit
+        from lib.capture import CaptureWriter
+        if self.device_count != 1:
+            root, extension = os.path.splitext(path)
+            path = f'{root}-{self.device_config["name"]}{extension}'
+        recorder = CaptureWriter(path, self.device_config)
+        atexit.register(recorder.close)
+        self.victron_type.recorder = recorder
+        logger.info(f'{self.device_config["name"]}: Recording raw data to {path}')
+
+    def send_hass_discovery(self):
+        from lib.hass_discovery import get_discovery, DEFAULT_CACHE_FILE
+        pid, ser, fw = self.victron_type.get_device_info()
+        mapping_table = self.victron_type.get_mapping_table()
+        payloads = helper.build_hass_config_payloads(self.device_config['name'],
+                                                     pid,
+                                                     ser,
+                                                     fw,
+                                                     mapping_table,
+                                                     self.config['mqtt']['base_topic'],
+                                                     self.collections,
+                                                     self.batch is not None)
+        discovery = get_discovery(self.config['mqtt'].get('hass_cache', DEFAULT_CACHE_FILE))
+        discovery.publish(self.device_config['name'], payloads, self.given_output)
 
     def connect_disconnect_loop(self):
         self.victron_type.connect_disconnect_loop(self.cmd, self.config['timer'])
 
+    def close(self):
+        """
+        Stops the timers and the device (serial reader, gatt connection), before the device is restarted
+        """
+        with self.collection_lock:
+            self.closed = True
+            if self.collection_timer is not None:
+                self.collection_timer.cancel()
+        with self.batch_lock:
+            if self.batch_timer is not None:
+                self.batch_timer.cancel()
+                self.batch_timer = None
+        if self.victron_type is not None:
+            self.victron_type.shutdown()
+
     def reset_collection(self, collection_name):
         collection = {}
         for item in self.config['collections'][self.device_config['name']][collection_name]:
             collection[item] = None
         self.collections[collection_name] = collection
+        self.collection_missing[collection_name] = len(collection)
+        self.collection_updated[collection_name] = {}
 
-    def collection_check_full(self, collection):
-        for value in collection.values():
-            if value is None:
-                return False
-        return True
+    def collection_check_full(self, collection_name):
+        return self.collection_missing[collection_name] == 0
 
     def set_value_in_collections(self, value_name, value, vunit):
-        for col_key in self.collections.keys():
-            if value_name in self.collections[col_key]:
-                self.collections[col_key][value_name] = {
-                    'value': value,
-                    'unit': vunit,
-                    'updated': f'{datetime.now():%Y-%m-%d %H:%M:%S}'
-                }
-                logger.debug(f'{self.device_config["name"]}: Setting value in collection: {value_name} to {value}')
-                return col_key
-        return False
+        col_key = self.collection_index.get(value_name)
+        if col_key is None:
+            return False
+        collection = self.collections[col_key]
+        if collection[value_name] is None:
+            self.collection_missing[col_key] -= 1
+        collection[value_name] = {
+            'value': value,
+            'unit': vunit,
+            'updated': f'{datetime.now():%Y-%m-%d %H:%M:%S}'
+        }
+        self.collection_updated[col_key][value_name] = time.monotonic()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'{self.device_config["name"]}: Setting value in collection: {value_name} to {value}')
+        return col_key
+
+    def collection_changed(self, col_key):
+        if self.publish_filter is None:
+            return True
+        # the updated timestamp changes every time, only the values count
+        values = {name: item['value'] if item is not None else None for name, item in self.collections[col_key].items()}
+        return self.publish_filter.should_publish(col_key, values)
+
+    def evict_stale_values(self, col_key, now):
+        collection = self.collections[col_key]
+        updated = self.collection_updated[col_key]
+        for value_name, update_time in list(updated.items()):
+            if now - update_time > self.collection_max_age:
+                logger.debug(f'{self.device_config["name"]}: {value_name} is older than {self.collection_max_age} seconds, removing it from {col_key}')
+                collection[value_name] = None
+                del updated[value_name]
+                self.collection_missing[col_key] += 1
+
+    def publish_collection(self, col_key, now):
+        """
+        Publishes a full collection or a partial one at its flush deadline
+        """
+        if self.collection_max_age:
+            self.evict_stale_values(col_key, now)
+        if self.collection_flush:
+            self.collection_deadline[col_key] = now + self.collection_flush
+        if self.collection_missing[col_key] == len(self.collections[col_key]):
+            # nothing to publish
+            return
+        if self.collection_changed(col_key):
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{self.device_config["name"]}: Collection:  {json.dumps(self.collections[col_key])}')
+            # the collection keeps changing while it waits in the output queue
+            self.publish(col_key, dict(self.collections[col_key]),
+                         count=len(self.collections[col_key]) - self.collection_missing[col_key])
+
+    def check_collection_deadlines(self):
+        """
+        Runs in the timer thread at the next deadline
+        """
+        with self.collection_lock:
+            if self.closed:
+                return
+            now = time.monotonic()
+            for col_key, deadline in self.collection_deadline.items():
+                if now >= deadline:
+                    logger.debug(f'{self.device_config["name"]}: Flush deadline of {col_key} reached, '
+                                 f'{self.collection_missing[col_key]} values missing')
+                    self.publish_collection(col_key, now)
+            # full collections moved their deadline in between, the timer may have been early
+            self.next_collection_deadline = min(self.collection_deadline.values())
+            self.schedule_collection_deadline(now)
+
+    def schedule_collection_deadline(self, now):
+        self.collection_timer = threading.Timer(max(self.next_collection_deadline - now, 0),
+                                                self.check_collection_deadlines)
+        self.collection_timer.daemon = True
+        self.collection_timer.start()
+
+    def publish(self, category, value, vunit=None, count=1):
+        """
+        Gives a value, collection or batch to the output
+        :param count: Number of values in value
+        """
+        self.given_output(self.device_config['name'], category, value, vunit=vunit)
+        self.values_published.inc(count)
 
     def output(self, category, value, vunit=None):
+        self.values_decoded.inc()
+        if self.store is not None:
+            # every reading is stored, independent of filter and collections
+            self.store.add(self.device_config['name'], category, value)
         if not self.cmd.collection:
-            self.given_output(self.device_config['name'], category, value)
+            if self.publish_filter is None or self.publish_filter.should_publish(category, value):
+                if self.batch is None:
+                    self.publish(category, value, vunit=vunit)
+                else:
+                    with self.batch_lock:
+                        self.batch[category] = value
         else:
-            col_key = self.set_value_in_collections(category, value, vunit)
-            if not col_key:
-                logger.debug(
-                    f'{self.device_config["name"]}: {category} not in any collections, it will never be published')
-            else:
-                if self.collection_check_full(self.collections[col_key]):
-                    logger.debug(f'{self.device_config["name"]}: Collection:  {json.dumps(self.collections[col_key])}')
-                    self.given_output(self.device_config["name"], col_key, self.collections[col_key])
+            with self.collection_lock:
+                col_key = self.set_value_in_collections(category, value, vunit)
+                if not col_key:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f'{self.device_config["name"]}: {category} not in any collections, '
+                                     f'it will never be published')
+                elif self.collection_check_full(col_key):
+                    self.publish_collection(col_key, time.monotonic())
+
+    def flush(self, delay=0):
+        """
+        Publishes the batched values, called by the devices at the end of a frame
+        :param delay: Seconds to wait for more values, e.g. for a burst of notifications
+        """
+        if self.batch is None:
+            return
+        with self.batch_lock:
+            if delay:
+                if self.batch_timer is None:
+                    self.batch_timer = threading.Timer(delay, self.flush)
+                    self.batch_timer.daemon = True
+                    self.batch_timer.start()
+                return
+            batch = self.batch
+            self.batch = {}
+            self.batch_timer = None
+        if not batch:
+            return
+
+        self.publish(None, batch, count=len(batch))
+        if self.per_value_topics:
+            for category, value in batch.items():
+                self.given_output(self.device_config['name'], category, value)
@@ -1,18 +1,25 @@
-import gatt
 import logging
 import time
+import lib.gatt_manager
 from datetime import datetime, timedelta
 
 logger = logging.getLogger()
-manager = gatt.DeviceManager(adapter_name="hci0")
+
+# Seconds to collect notifications into one batch in streaming mode
+STREAMING_BATCH_DELAY = 0.5
 
 
 class VictronBle:
-    def __init__(self, device_config, output):
+    def __init__(self, device_config, output, flush):
         self.device_config = device_config
         self.victron_device = None
         self.gatt_device = None
         self.output = output
+        self.flush = flush
+        # CaptureWriter, records the raw values
+        self.recorder = None
+        # Streaming: stay connected and publish every notification instead of reconnecting every cycle
+        self.streaming = self.device_config.get('streaming', False)
 
         if self.device_config['type'] == 'smartshunt':
             from lib.victron_ble.victron_smartshunt_ble import SmartshuntBLE
@@ -33,44 +40,55 @@ class VictronBle:
     def handle_value(self, characteristics, data):
         last_expected_value = self.victron_device.handle_one_value(self.output, characteristics, data)
 
-        if last_expected_value:
+        if self.streaming:
+            # every notification is a single value, wait for the rest of the burst
+            self.flush(STREAMING_BATCH_DELAY)
+        elif last_expected_value:
+            # in streaming mode every value was received after a few notifications already, not worth a log line
+            logger.info(f'{self.device_config["name"]}: Gathering data successful')
+            self.flush()
+
+        # no gatt device on replay of a capture
+        if last_expected_value and not self.streaming and self.gatt_device is not None:
             logger.debug(f'{self.device_config["name"]}: Got last value, disconnecting...')
             self.gatt_device.disconnect()
 
-    def connect_loop(self):
-        manager.start_discovery()
-        time.sleep(1)
-
-        try:
-            logger.info(f'{self.device_config["name"]}: Connecting...')
-            self.gatt_device.connect()
-        except:
-            logger.error(f'{self.device_config["name"]}: failed to connect. Trying again shortly.')
-            return False
-        finally:
-            manager.stop_discovery()
+    def shutdown(self):
+        if self.gatt_device is not None and self.gatt_device.is_connected():
+            self.gatt_device.disconnect()
 
-        if not self.gatt_device.connected:
-            return False
-        else:
-            manager.run()
-            return True
+    def connect_loop(self):
+        return lib.gatt_manager.connect_and_wait(self.gatt_device, self.device_config['name'])
 
     def connect_disconnect_loop(self, args, timer):
+        if args.direct_disconnect and self.streaming:
+            logger.info(f'{self.device_config["name"]}: Direct disconnect enabled, streaming disabled')
+            self.streaming = False
+
         options = {
-            'direct_disconnect': args.direct_disconnect
+            'direct_disconnect': args.direct_disconnect,
+            'streaming': self.streaming,
+            'recorder': self.recorder
         }
         self.gatt_device = self.victron_device.get_gatt_device_instance(
-            manager,
+            lib.gatt_manager.get_manager(),
             self.handle_value,
             options
         )
 
         while True:
-            if self.connect_loop():
+            # a partial count of the cycle before must not complete this one
+            self.victron_device.reset()
+            connected = self.connect_loop()
+            # values of an incomplete read cycle
+            self.flush()
+            if connected:
                 if args.direct_disconnect:
                     logger.debug(f'{self.device_config["name"]}: Direct disconnect enabled. Exiting...')
                     break
+                elif self.streaming:
+                    logger.info(f'{self.device_config["name"]}: Streaming connection lost, reconnecting shortly')
+                    time.sleep(timer['retry'])
                 else:
                     next_time = datetime.now() + timedelta(seconds=timer['bluetooth-ble']['repeat'])
                     logger.debug(f'{self.device_config["name"]}: Will reconnect at {next_time}')
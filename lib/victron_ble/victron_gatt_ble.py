@@ -6,11 +6,15 @@ from time import sleep
 import gatt
 from gatt.gatt_linux import Characteristic
 import logging
+import lib.metrics as metrics
 import threading
 import time
 
 logger = logging.getLogger()
 
+# Keep-alive characteristic is un16 in milliseconds, 0xFFFF keeps the connection alive forever
+KEEP_ALIVE_FOREVER = 0xFFFF
+
 
 class AnyDevice(gatt.Device):
     """
@@ -25,33 +29,47 @@ class AnyDevice(gatt.Device):
         handle_value_function,
         keep_alive,
         handle_uuid_map,
+        notify_uuids,
         options
     ):
         super().__init__(mac_address, manager, managed=True)
         self.handle_value_function = handle_value_function
         self.connected = False
+        # set by connect_succeeded or connect_failed, the result of a connect arrives on the gatt main loop
+        self.connect_finished = threading.Event()
+        self.disconnected = threading.Event()
         self.keep_alive = keep_alive
         self.handle_uuid_map = handle_uuid_map
+        self.notify_uuids = notify_uuids
         self.name = name
         self.options = options
+        self.recorder = options.get('recorder')
+        # monotonic time of the last value, for the connect to last value metric
+        self.last_value_time = None
+        # CycleTimer of the current connect cycle, set by connect_and_wait
+        self.cycle_timer = None
 
     def connect_succeeded(self):
         super().connect_succeeded()
         logger.info(f"{self.name}: Connect successful!")
         self.connected = True
+        self.connect_finished.set()
         time.sleep(0)
 
     def connect_failed(self, error):
         super().connect_failed(error)
         logger.error(f"{self.name}: Connection failed: {str(error)}!")
         self.connected = False
+        self.connect_finished.set()
         time.sleep(0)
 
     def disconnect_succeeded(self):
         super().disconnect_succeeded()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('disconnect')
         logger.info(f"{self.name}: Disconnect successful!")
         time.sleep(0)
-        self.manager.stop()
+        self.disconnected.set()
 
     def characteristic_write_value_succeeded(self, characteristic):
         logger.debug(f"{self.name}: write succeeded")
@@ -67,30 +85,63 @@ class AnyDevice(gatt.Device):
 
     def services_resolved(self):
         super().services_resolved()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('services_resolved')
         self.connected = True
         logger.debug(f"{self.name}: [{self.mac_address}] Resolved services")
+        if self.options.get('streaming'):
+            self.set_keep_alive()
         for service in self.services:
             if service.uuid in self.handle_uuid_map:
                 for characteristic in service.characteristics:
                     logger.debug(f'{self.name}: Read value from characteristic {characteristic}')
                     characteristic.read_value()
+                    if self.options.get('streaming') and characteristic.uuid in self.notify_uuids:
+                        logger.debug(f'{self.name}: Enable notifications for characteristic {characteristic}')
+                        characteristic.enable_notifications()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('notifications_subscribed')
+        time.sleep(0)
+
+    def characteristic_enable_notifications_succeeded(self, characteristic):
+        logger.debug(f"{self.name}: enable notifications succeeded on characteristic {characteristic.uuid}")
+        time.sleep(0)
+
+    def characteristic_enable_notifications_failed(self, characteristic, error):
+        logger.warning(f"enable notifications failed on characteristic {characteristic.uuid} | merror: {error}")
         time.sleep(0)
 
     def characteristic_value_updated(self, characteristic, value):
+        self.last_value_time = time.monotonic()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('first_value')
+        if self.recorder is not None:
+            from lib.capture import KIND_CHARACTERISTIC
+            self.recorder.record(KIND_CHARACTERISTIC, value, characteristic.uuid)
         try:
             self.handle_value_function(characteristic, value)
         except Exception as e:
+            metrics.UNRECOGNIZED_FRAMES.labels(self.name).inc()
             logger.debug(f"UNRECOGNIZED DATA: {self.name}: error handling: {value}: {e}")
         time.sleep(0)
 
-    def set_keep_alive(self):
+    def set_keep_alive(self, seconds=None):
+        """
+        Writes the keep-alive characteristic, the device keeps the connection open for given time without traffic
+        :param seconds: Seconds (max 65.534), None or more keeps the connection alive forever
+        """
+        if seconds is None or seconds * 1000 >= KEEP_ALIVE_FOREVER:
+            value = KEEP_ALIVE_FOREVER
+        else:
+            value = max(int(seconds * 1000), 0)
         for service in self.services:
-            if service.uuid in self.keep_alive:
-                ## 60 seconds!
-                service.write_value("60ea")
+            for characteristic in service.characteristics:
+                if characteristic.uuid in self.keep_alive.values():
+                    logger.debug(f'{self.name}: Set keep-alive to {value:#06x}')
+                    characteristic.write_value(value.to_bytes(2, "little"))
 
 
-def gatt_device_instance(manager, mac, name, handle_value_function, keep_alive, handle_uuid_map, options):
+def gatt_device_instance(manager, mac, name, handle_value_function, keep_alive, handle_uuid_map, notify_uuids, options):
     return AnyDevice(
         mac,
         name,
@@ -98,5 +149,6 @@ def gatt_device_instance(manager, mac, name, handle_value_function, keep_alive,
         handle_value_function=handle_value_function,
         keep_alive=keep_alive,
         handle_uuid_map=handle_uuid_map,
+        notify_uuids=notify_uuids,
         options=options,
     )
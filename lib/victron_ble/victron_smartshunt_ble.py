@@ -1,5 +1,4 @@
 import logging
-from lib.victron_ble.victron_gatt_ble import AnyDevice, gatt_device_instance
 import lib.helper
 logger = logging.getLogger()
 
@@ -52,16 +51,24 @@ class SmartshuntBLE:
         self.config = config
         self.count_values = 0
 
+    def reset(self):
+        """
+        Forgets the values counted so far, called before every connect
+        """
+        self.count_values = 0
+
     def get_mapping_table(self):
         return self.MAP
 
     def get_gatt_device_instance(self, manager, handle_value_function, options):
+        from lib.victron_ble.victron_gatt_ble import gatt_device_instance
         return gatt_device_instance(
             manager,
             self.config['mac'],
             handle_value_function=handle_value_function,
             keep_alive=self.keep_alive_handle_uuid_map,
             handle_uuid_map=self.read_handle_uuid_map,
+            notify_uuids=list(self.MAP.keys()),
             name=self.config['name'],
             options=options
         )
@@ -80,8 +87,9 @@ class SmartshuntBLE:
             #result_value = lib.helper.convert_value_unknown(data, None)
             result_signed = lib.helper.convert_value_number(data, ['', '', '', 1, True])
             result_unsigned = lib.helper.convert_value_number(data, ['', '', '', 1, False])
-            logger.debug(f'{self.config["name"]}: Characteristic ({characteristic.uuid}) not found in known Table | Rawvalue: {data}')
-            logger.debug(f'{self.config["name"]}: Characteristic ({characteristic.uuid}) not found in known Table | Value signed: {result_signed} | Value unsigned: {result_unsigned}')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{self.config["name"]}: Characteristic ({characteristic.uuid}) not found in known Table | Rawvalue: {data}')
+                logger.debug(f'{self.config["name"]}: Characteristic ({characteristic.uuid}) not found in known Table | Value signed: {result_signed} | Value unsigned: {result_unsigned}')
         else:
             self.count_values += 1
             command = self.MAP[characteristic.uuid]
@@ -89,7 +97,7 @@ class SmartshuntBLE:
             output(command[1], result_value, vunit=command[2])
 
         if self.count_values == len(self.MAP):
-            logger.info(f'{self.config["name"]}: Gathering data successful')
+            self.count_values = 0
             return True
         else:
             return False
@@ -0,0 +1,52 @@
+# Every value starts with a 4 byte header, e.g. 0x08 0x03 0x19 0xED
+# The fixed 0x19 at offset 2 is searched with bytes.find, the byte before must be 0x03 or 0x00
+SYNC_BYTE = 0x19
+SYNC_OFFSET = 2
+PROTOCOL_BYTES = (0x03, 0x00)
+
+
+def find_signature(data, start=0):
+    """
+    Finds the start of the next value in one linear pass
+    :param data: bytes or bytearray
+    :param start: Offset to start searching from
+    :return: Offset of the next value or -1
+    """
+    pos = data.find(SYNC_BYTE, start + SYNC_OFFSET)
+    while pos >= 0:
+        if data[pos - 1] in PROTOCOL_BYTES:
+            return pos - SYNC_OFFSET
+        pos = data.find(SYNC_BYTE, pos + 1)
+    return -1
+
+
+class FrameSync:
+    """
+    Finds the start of the next value in a ReassemblyBuffer.
+    The scanner remembers up to which stream position it found no value start, so bytes of a partial buffer are not
+    scanned again when more bytes arrive.
+    """
+
+    def __init__(self):
+        self.resume = 0
+
+    def find(self, buffer):
+        """
+        :param buffer: ReassemblyBuffer
+        :return: Offset of the next value relative to the unread bytes or -1
+        """
+        data = buffer.data
+        # index in data = stream position + base
+        base = buffer.start - buffer.offset
+        end = buffer.end
+        index = max(self.resume + base, buffer.start + SYNC_OFFSET)
+        while True:
+            index = data.find(SYNC_BYTE, index, end)
+            if index < 0:
+                self.resume = end - base
+                return -1
+            if data[index - 1] in PROTOCOL_BYTES:
+                # stay on this match, it is found again directly if the value still needs more bytes
+                self.resume = index - base
+                return index - SYNC_OFFSET - buffer.start
+            index += 1
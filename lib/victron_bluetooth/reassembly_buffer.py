@@ -0,0 +1,67 @@
+DEFAULT_CAPACITY = 1024
+
+
+class ReassemblyBuffer:
+    """
+    Fixed-capacity buffer to reassemble values which are split over several bulk notifications.
+
+    New bytes are written behind the unread bytes, decoding works in place on a memoryview of the unread bytes
+    and consumed bytes are only skipped, never copied. The unread bytes are moved to the front only when the
+    free space at the end is too small for new bytes. If the unread bytes exceed the capacity, the oldest bytes are
+    dropped and counted in dropped.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.data = bytearray(capacity)
+        self.view = memoryview(self.data)
+        self.start = 0
+        self.end = 0
+        # Position of the first unread byte in the whole stream of bytes given to extend
+        self.offset = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def extend(self, value):
+        length = len(value)
+        if length > self.capacity:
+            drop = len(self) + length - self.capacity
+            self.dropped += drop
+            self.offset += drop
+            value = memoryview(value)[length - self.capacity:]
+            length = self.capacity
+            self.clear()
+
+        if self.end + length > self.capacity:
+            unread = len(self)
+            if unread + length > self.capacity:
+                drop = unread + length - self.capacity
+                self.dropped += drop
+                self.offset += drop
+                self.start += drop
+                unread -= drop
+            self.view[:unread] = self.view[self.start:self.end]
+            self.start = 0
+            self.end = unread
+
+        self.view[self.end:self.end + length] = value
+        self.end += length
+
+    def unread(self):
+        """
+        :return: memoryview of the unread bytes, only valid until the next call of extend
+        """
+        return self.view[self.start:self.end]
+
+    def consume(self, length):
+        length = min(length, len(self))
+        self.start += length
+        self.offset += length
+        if self.start == self.end:
+            self.clear()
+
+    def clear(self):
+        self.start = 0
+        self.end = 0
@@ -0,0 +1,79 @@
+import struct
+import lib.helper
+
+# Precompiled unpackers for numeric registers: (signed, length) -> struct.Struct
+UNPACKERS = {
+    (False, 1): struct.Struct('<B'),
+    (True, 1): struct.Struct('<b'),
+    (False, 2): struct.Struct('<H'),
+    (True, 2): struct.Struct('<h'),
+    (False, 4): struct.Struct('<I'),
+    (True, 4): struct.Struct('<i'),
+    (False, 8): struct.Struct('<Q'),
+    (True, 8): struct.Struct('<q'),
+}
+
+# Length is a nibble of the length/type byte
+MAX_LENGTH = 0x0F
+
+
+class RegisterDecoder:
+    """
+    Decoder for one register with a given data length, compiled from a row of the *_NAMES tables:
+    (Category, Description, Unit, Multiplier, Signed?, Interpret_function)
+    """
+    __slots__ = ('command', 'name', 'unit', 'scale', 'length', 'unpack', 'integer', 'converter')
+
+    def __init__(self, command, length):
+        self.command = command
+        self.name = command[1]
+        self.unit = command[2]
+        self.scale = command[3]
+        self.length = length
+
+        converter = command[5] if len(command) > 5 else lib.helper.convert_value_number
+        numeric = converter in (lib.helper.convert_value_number, lib.helper.convert_value_int)
+        if numeric and (command[4], length) in UNPACKERS:
+            self.unpack = UNPACKERS[(command[4], length)].unpack_from
+            self.integer = converter is lib.helper.convert_value_int
+            self.converter = None
+        else:
+            # strings, firmware versions and odd lengths keep their interpret function
+            self.unpack = None
+            self.integer = False
+            self.converter = converter
+
+    def decode(self, value, offset):
+        """
+        :param value: bytes-like packet
+        :param offset: Offset of the register data in value
+        :return: Decoded value: int or float for numeric registers, str otherwise
+        """
+        if self.unpack is None:
+            return self.converter(bytes(value[offset:offset + self.length]), self.command)
+        raw, = self.unpack(value, offset)
+        if self.integer:
+            return int(raw / self.scale)
+        return lib.helper.scale_value(raw, self.scale)
+
+
+def compile_register_decoders(category_lookup):
+    """
+    Flattens the category lookup into one dispatch table
+    :param category_lookup: {category header: (description, {register: command})}
+    :return: {(category header, register, length): RegisterDecoder}
+    """
+    decoders = {}
+    for category_type, (_, names) in category_lookup.items():
+        for register, command in names.items():
+            for length in range(MAX_LENGTH + 1):
+                decoders[(category_type, register, length)] = RegisterDecoder(command, length)
+    return decoders
+
+
+def compile_fixed_decoders(names, length=1):
+    """
+    :param names: {register: command}
+    :return: {register: RegisterDecoder}
+    """
+    return {register: RegisterDecoder(command, length) for register, command in names.items()}
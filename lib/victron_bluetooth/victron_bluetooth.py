@@ -1,17 +1,20 @@
-import copy
-import gatt
 import logging
 import time
+import lib.gatt_manager
 import lib.helper
-from collections import namedtuple
+import lib.metrics as metrics
+import struct
 from datetime import datetime, timedelta
 from enum import IntEnum
+from lib.victron_bluetooth.frame_sync import FrameSync, find_signature, SYNC_OFFSET
+from lib.victron_bluetooth.reassembly_buffer import ReassemblyBuffer
+from lib.victron_bluetooth.register_decoder import compile_register_decoders, compile_fixed_decoders
 
 logger = logging.getLogger()
-manager = gatt.DeviceManager(adapter_name="hci0")
 
 VALUE_PREFIX = bytes.fromhex("08031903")
-Header = namedtuple("Header", ["value_type", "category_type", "length"])
+HEADER = struct.Struct("<I")
+HEADER_LENGTH = 4
 COMMAND_POS = 0
 LENGHT_TYPE_POS = 1
 DATA_POS = 2
@@ -151,10 +154,9 @@ FIXEDLEN_CATEGORY_LOOKUP = {
     0x0F190308: "mixed settings",
 }
 
-SIGNATURE = [
-    (1, (0x03, 0x00)),
-    (2, (0x19,)),
-]
+# Compiled once: (category header, register, length) -> RegisterDecoder
+REGISTER_DECODERS = compile_register_decoders(VARLEN_CATEGORY_LOOKUP)
+FIXED_DECODERS = compile_fixed_decoders(MIXED_SETTINGS_NAMES)
 
 SOLAR_HISTORY_VALUES = [
     (12, 2, ("History", "Battery Voltage Max", "V", 100, True)),
@@ -167,12 +169,18 @@ SOLAR_HISTORY_VALUES = [
 
 
 class VictronBluetooth:
-    def __init__(self, device_config, output):
+    def __init__(self, device_config, output, flush):
         self.device_config = device_config
         self.victron_device = None
         self.gatt_device = None
         self.output = output
-        self.buffer = bytearray()
+        self.flush = flush
+        # CaptureWriter, records the raw notifications
+        self.recorder = None
+        self.buffer = ReassemblyBuffer()
+        self.frame_sync = FrameSync()
+        self.garbage = 0
+        self.unrecognized = metrics.UNRECOGNIZED_FRAMES.labels(device_config['name'])
 
         if self.device_config['type'] == 'smartsolar':
             from lib.victron_bluetooth.victron_smartsolar import Smartsolar
@@ -212,33 +220,23 @@ class VictronBluetooth:
         return hass_mapping_table
 
     def finished_target(self):
-        self.gatt_device.disconnect()
+        if self.gatt_device is not None:
+            self.gatt_device.disconnect()
         logger.debug(f'{self.device_config["name"]}: Thread finished')
-        manager.stop()
+
+    def shutdown(self):
+        if self.gatt_device is not None and self.gatt_device.is_connected():
+            self.gatt_device.disconnect()
 
     def connect_loop(self):
-        manager.start_discovery()
-        time.sleep(1)
-
-        try:
-            logger.info(f'{self.device_config["name"]}: Connecting...')
-            self.gatt_device.connect()
-        except:
-            logger.error(f'{self.device_config["name"]}: failed to connect. Trying again shortly.')
-            return False
-        finally:
-            manager.stop_discovery()
-
-        if not self.gatt_device.connected:
-            return False
-        else:
-            manager.run()
-            return True
+        return lib.gatt_manager.connect_and_wait(self.gatt_device, self.device_config['name'])
 
     def connect_disconnect_loop(self, args, timer):
-        options = {}
+        options = {
+            'recorder': self.recorder
+        }
         self.gatt_device = self.victron_device.get_gatt_device_instance(
-            manager,
+            lib.gatt_manager.get_manager(),
             self.handle_single_value,
             self.handle_bulk_values,
             options
@@ -255,28 +253,63 @@ class VictronBluetooth:
                 time.sleep(timer['retry'])
 
     def handle_bulk_values(self, value):
+        self.decode_bulk_values(value)
+        # one notification is one batch, values split over notifications follow in the next batch
+        self.flush()
+
+    def decode_bulk_values(self, value):
         self.buffer.extend(value)
-        pos = self.start_of_packet(self.buffer)
-        while len(self.buffer) > 0 and pos >= 0:
-            consumed = self.handle_one_value(self.buffer[pos:])
+        while len(self.buffer) > 0:
+            pos = self.frame_sync.find(self.buffer)
+            packet = self.buffer.unread()
+            if pos < 0:
+                # Only the last bytes may still become the start of a value when more bytes arrive
+                garbage = max(len(packet) - SYNC_OFFSET, 0)
+                self.skip_garbage(packet[:garbage], 'unknown value in bulk')
+                self.buffer.consume(garbage)
+                return
+            if pos > 0:
+                self.skip_garbage(packet[:pos], 'unknown value in bulk')
+                self.buffer.consume(pos)
+                continue
+
+            try:
+                consumed = self.handle_one_value(packet)
+            except (KeyError, ValueError) as e:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f'UNRECOGNIZED DATA: {self.device_config["name"]}: bulk: {e}')
+                self.unrecognized.inc()
+                self.garbage += 1
+                self.buffer.consume(1)
+                continue
             if consumed == -1:
-                logger.debug(f'UNRECOGNIZED DATA: {self.device_config["name"]}: bulk: need more bytes')
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f'UNRECOGNIZED DATA: {self.device_config["name"]}: bulk: need more bytes')
                 return
-            self.buffer = self.buffer[pos + consumed:]
-            pos = self.start_of_packet(self.buffer)
-            if pos > 0:  # TODO BUG: midnight hacking
-                unknown = self.buffer[:pos]
-                logger.debug(f'UNRECOGNIZED DATA: {self.device_config["name"]}: unknown value in bulk: {unknown}')
+            self.buffer.consume(consumed)
 
     def handle_single_value(self, value):
-        value_origin = copy.deepcopy(value)
-        pos = self.start_of_packet(value)
+        packet = memoryview(value)
+        offset = 0
+        pos = find_signature(value, offset)
         while pos >= 0:
-            consumed = self.handle_one_value(value[pos:])
-            value = value[pos + consumed :]
-            pos = self.start_of_packet(value)
-        if len(value) > 0:
-            logger.debug(f'UNRECOGNIZED DATA: {self.device_config["name"]}: unknown single packet: value:{value} - value_origin:{value_origin}')
+            consumed = self.handle_one_value(packet[pos:])
+            if consumed == -1:
+                break
+            offset = pos + consumed
+            pos = find_signature(value, offset)
+        if offset < len(value):
+            self.unrecognized.inc()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'UNRECOGNIZED DATA: {self.device_config["name"]}: unknown single packet: value:{bytes(packet[offset:])} - value_origin:{value}')
+        self.flush()
+
+    def skip_garbage(self, garbage, reason):
+        if len(garbage) > 0:
+            self.garbage += len(garbage)
+            self.unrecognized.inc()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'UNRECOGNIZED DATA: {self.device_config["name"]}: {reason}: {bytes(garbage)}')
 
     def decode_history_packet(self, command, value):
         total_length = value[DATA_POS]
@@ -290,104 +323,61 @@ class VictronBluetooth:
             values += [{"command": command, "value": lib.helper.convert_value_number(data, command)}]
 
         day_index = value[35]
-        logger.debug(f"Day Index: {day_index -54} alternative (should match): {command-0x50}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Day Index: {day_index -54} alternative (should match): {command-0x50}")
         return values, total_length
 
-    def decode_var_len(self, value, config_table):
-        length_type_field = value[LENGHT_TYPE_POS]
-        length = length_type_field & 0x0F
-        type_id = (length_type_field & 0xF0) >> 4
-        data = value[DATA_POS:DATA_POS + length]
-
-        command = value[COMMAND_POS]
-        if HISTORY_MIN_CMD <= command <= HISTORY_MAX_CMD:
-            return self.decode_history_packet(command, value)
-
-        if command not in config_table:
-            raise KeyError(f"unknown command (in var len) 0x{command:x} in {config_table.keys()}")
-
-        #data_label = get_label(command, config_table)
-        #config = config_table[command]
-        #data_string = format_value(data, config)
-        command = self.get_command(command, config_table)
-        value_string = command[5](data, command)
-
-        consumed = 2 + length
-        return [{"command": command, "value": value_string}], consumed
-
-    def decode_fixed_len(self, value):
-        """function expects whole packet with 4-byte prefix"""
-        DATATYPE_POS = 0
-        DATA_POS = 1
-        consumed = 2
-
-        data = value[DATA_POS]
-        data_type = value[DATATYPE_POS]
-        command = self.get_command(data_type, MIXED_SETTINGS_NAMES)
-        if not command:
-            raise KeyError(f"unknown command (in fixed len) 0x{command:x}")
-        value_string = lib.helper.convert_value_number(data, command)
-
-        return [{"command": command, "value": value_string}], consumed
-
-    def start_of_packet(self, value):
-        for offset, _ in enumerate(value):
-            # slice from start of signature to end
-            result = self.signature_complete(value[offset:], SIGNATURE)
-            if result:
-                return offset
-        return -1
-
-    def get_command(self, command, command_names):
-        try:
-            return command_names[command]
-        except:
-            return False
-
-    def decode_header(self, header_4b):
-        return Header(VALUE_TYPES(header_4b[0]), int.from_bytes(bytes(header_4b[:4]), "little"), 4)
-
-    def signature_complete(self, value, signature):
-        try:
-            for pos, sigs in signature:
-                if not value[pos] in sigs:
-                    return False
-            return True
-        except:
-            return False
-
     def handle_one_value(self, value):
-        header = self.decode_header(value)
-
-        if (
-            header.value_type == VALUE_TYPES.FIXED_LEN
-            and len(value) < 6
-            or header.value_type == VALUE_TYPES.VAR_LEN
-            and len(value) < 6
-        ):
+        """
+        Decodes the value at the start of value
+        :param value: bytes-like, starting with the 4 byte header
+        :return: Consumed bytes or -1 if more bytes are needed
+        """
+        if len(value) < HEADER_LENGTH + DATA_POS:
             return -1
 
-        result = ""
-        consumed = header.length
-        used = 0
+        value_type = value[0]
+        if value_type == VALUE_TYPES.VAR_LEN:
+            category_type, = HEADER.unpack_from(value)
+            command = value[HEADER_LENGTH + COMMAND_POS]
+            length = value[HEADER_LENGTH + LENGHT_TYPE_POS] & 0x0F
+
+            if HISTORY_MIN_CMD <= command <= HISTORY_MAX_CMD and category_type in VARLEN_CATEGORY_LOOKUP:
+                return self.handle_history_packet(command, value)
+
+            decoder = REGISTER_DECODERS.get((category_type, command, length))
+            if decoder is None:
+                raise KeyError(f"unknown command (in var len) 0x{command:x} in category 0x{category_type:x}")
+            consumed = HEADER_LENGTH + DATA_POS + length
+            if len(value) < consumed:
+                return -1
+        elif value_type == VALUE_TYPES.FIXED_LEN:
+            command = value[HEADER_LENGTH + COMMAND_POS]
+            decoder = FIXED_DECODERS.get(command)
+            if decoder is None:
+                raise KeyError(f"unknown command (in fixed len) 0x{command:x}")
+            consumed = HEADER_LENGTH + 2
+        else:
+            raise ValueError(f"unknown value type 0x{value_type:x}")
+
+        result = decoder.decode(value, consumed - decoder.length)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'{self.device_config["name"]}: Collected {decoder.name} -> {result}')
+        self.output(decoder.name, result, vunit=decoder.unit)
 
-        if header.value_type == VALUE_TYPES.FIXED_LEN:
-            result, used = self.decode_fixed_len(value[consumed:])
-            #if not command:
-            #    logger.warning(f'{device_name}: {value}')
-            #    return consumed
+        return consumed
 
-        if header.value_type == VALUE_TYPES.VAR_LEN:
-            category = VARLEN_CATEGORY_LOOKUP[header.category_type]
-            result, used = self.decode_var_len(value[consumed:], category[1])
+    def handle_history_packet(self, command, value):
+        result, used = self.decode_history_packet(command, value[HEADER_LENGTH:])
+        if used == -1:
+            return -1
 
         for i in range(len(result)):
             value_name = result[i]['command'][1]
             value = result[i]['value']
 
-            logger.debug(f'{self.device_config["name"]}: Collected {value_name} -> {value}')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'{self.device_config["name"]}: Collected {value_name} -> {value}')
             self.output(value_name, value, vunit=result[i]['command'][2])
 
-        consumed += used
-
-        return consumed
+        return HEADER_LENGTH + used
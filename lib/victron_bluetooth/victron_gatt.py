@@ -6,6 +6,8 @@ from time import sleep
 import gatt
 from gatt.gatt_linux import Characteristic
 import logging
+import lib.metrics as metrics
+from lib.gatt_manager import call_later
 import threading
 import time
 
@@ -39,32 +41,49 @@ class AnyDevice(gatt.Device):
         super().__init__(mac_address, manager, managed=True)
         self.notification_table = notification_table
         self.connected = False
+        # set by connect_succeeded or connect_failed, the result of a connect arrives on the gatt main loop
+        self.connect_finished = threading.Event()
+        self.disconnected = threading.Event()
         self.ping = ping
         self.handle_uuid_map = handle_uuid_map
         self.name = name
         self.init_sequence_template = init_sequence_template
         self.options = options
+        self.recorder = options.get('recorder')
+        # monotonic time of the last value, for the connect to last value metric
+        self.last_value_time = None
+        # CycleTimer of the current connect cycle, set by connect_and_wait
+        self.cycle_timer = None
+        # per instance, several devices may be connected from one process
+        self.init_sequence = None
+        self.characteristics = {}
 
     def connect_succeeded(self):
         super().connect_succeeded()
         logger.info(f"{self.name}: Connected!")
         self.connected = True
+        self.connect_finished.set()
         time.sleep(0)
 
     def connect_failed(self, error):
         super().connect_failed(error)
         logger.error(f"{self.name}: Connection failed: {str(error)}!")
         self.connected = False
+        self.connect_finished.set()
         time.sleep(0)
 
     def disconnect_succeeded(self):
         super().disconnect_succeeded()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('disconnect')
         logger.info(f"{self.name}: Disconnected!")
         time.sleep(0)
-        self.manager.stop()
+        self.disconnected.set()
 
     def services_resolved(self):
         super().services_resolved()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('services_resolved')
         self.connected = True
         logger.debug(f"{self.name}: [{self.mac_address}] Resolved services")
         for service in self.services:
@@ -80,9 +99,10 @@ class AnyDevice(gatt.Device):
 
         logger.debug(f'{self.name}: Subscribe to notifications')
         self.subscribe_notifications()
-        time.sleep(2)
-        logger.debug(f'{self.name}: Send init sequence')
-        self.start_send_init_squence()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('notifications_subscribed')
+        logger.debug(f'{self.name}: Send init sequence in 2 seconds')
+        call_later(2, self.start_send_init_squence)
 
     def characteristic_enable_notification_succeeded(self, characteristic, value):
         logger.debug(f"{self.name}: enable notification succeded")
@@ -94,37 +114,50 @@ class AnyDevice(gatt.Device):
 
     def characteristic_write_value_succeeded(self, characteristic):
         logger.debug(f"{self.name}: write succeeded")
+        # the device needs a pause between the writes of the init sequence
+        call_later(1, self.continue_init_sequence)
+
+    def continue_init_sequence(self):
+        if not self.is_connected():
+            return
         try:
             self.send_init_sequence()
         except StopIteration:
-            pass
-        time.sleep(0)
+            if self.cycle_timer is not None:
+                self.cycle_timer.mark('init_sequence')
 
     def characteristic_write_value_failed(self, characteristic, error):
         logger.warning(f"write failed on charactersitic {characteristic.uuid}:merror: {error}")
         time.sleep(0)
 
     def characteristic_value_updated(self, characteristic, value):
+        self.last_value_time = time.monotonic()
+        if self.cycle_timer is not None:
+            self.cycle_timer.mark('first_value')
+        if self.recorder is not None:
+            from lib.capture import KIND_CHARACTERISTIC
+            self.recorder.record(KIND_CHARACTERISTIC, value, characteristic.uuid)
         try:
             if characteristic.uuid in self.notification_table.keys():
                 handler_fun = self.notification_table[characteristic.uuid]
                 handler_fun(value)
-            else:
+            elif logger.isEnabledFor(logging.DEBUG):
                 logger.debug(
                     f"{self.name}: unhandled characteristic updated: [{characteristic.uuid}]\tvalue:{value}"
                 )
         except Exception as e:
+            metrics.UNRECOGNIZED_FRAMES.labels(self.name).inc()
             logger.debug(f"UNRECOGNIZED DATA: {self.name}: error handling: {value}: {e}")
         time.sleep(0)
 
-    init_sequence = None
-    characteristics = {}
-
     def subscribe_notifications(self):
         logger.debug(f"{self.name}:subscribe notifications")
+        if not self.is_connected():
+            return
         if not self.characteristics:
-            logger.debug(f"{self.name}:characteristics empty, sleep & retry - CHECK DEVICE PAIRING!")
-            time.sleep(2)
+            logger.debug(f"{self.name}:characteristics empty, retry in 2 seconds - CHECK DEVICE PAIRING!")
+            call_later(2, self.subscribe_notifications)
+            return
         for key, uuid in self.handle_uuid_map.items():
             try:
                 logger.debug(f"{self.name}: notifications for {key}: {uuid}")
@@ -148,24 +181,24 @@ class AnyDevice(gatt.Device):
         time.sleep(0)
 
     def start_send_init_squence(self):
-        global init_sequence
-        init_sequence = self.init_sequence_template()
+        if not self.is_connected():
+            return
+        self.init_sequence = self.init_sequence_template()
         self.send_init_sequence()
 
     def send_init_sequence(self):
-        (uuid, handle, data) = next(init_sequence)
+        (uuid, handle, data) = next(self.init_sequence)
         if not self.characteristics:
             self.characteristics_missing()
+            return
         c = self.characteristics[uuid]
         logger.debug(f"{self.name}: sending {handle}, data{data}")
         c.write_value(data)
-        time.sleep(1)
 
     def characteristics_missing(self):
-        logger.debug(f"{self.name}: connected but characteristics not yet enumerated, sleep an retry")
+        logger.debug(f"{self.name}: connected but characteristics not yet enumerated, retry in 2 seconds")
         logger.debug(f"{self.name}: CHECK DEVICE PAIRING!")
-        time.sleep(2)
-        self.start_send_init_squence()
+        call_later(2, self.start_send_init_squence)
 
     def send_ping(self):
         logger.debug(f"{self.name}: send ping")
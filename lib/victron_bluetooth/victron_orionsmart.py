@@ -1,6 +1,3 @@
-from lib.victron_bluetooth.victron_gatt import gatt_device_instance
-
-
 class OrionSmart:
     HASS_MAPPING_TABLE = [0x36, 0x37, 0x38, 0x39, 0xBB, 0xE9]
 
@@ -126,8 +123,11 @@ class OrionSmart:
     def get_mapping_table(self):
         return self.HASS_MAPPING_TABLE
 
-    def get_gatt_device_instance(self, manager, handle_single_value, handle_bulk_values, options):
-        UUID_FUNCTION_TABLE = {
+    def get_notification_table(self, handle_single_value, handle_bulk_values):
+        """
+        :return: {characteristic uuid: handler function}
+        """
+        return {
             self.handle_uuid_map["0025"]: handle_single_value,
             self.handle_uuid_map["001b"]: handle_single_value,
             self.handle_uuid_map["000c"]: handle_single_value,
@@ -135,6 +135,11 @@ class OrionSmart:
             self.handle_uuid_map["0021"]: handle_bulk_values,
         }
 
+    def get_gatt_device_instance(self, manager, handle_single_value, handle_bulk_values, options):
+        from lib.victron_bluetooth.victron_gatt import gatt_device_instance
+
+        UUID_FUNCTION_TABLE = self.get_notification_table(handle_single_value, handle_bulk_values)
+
         return gatt_device_instance(
             manager,
             self.config['mac'],
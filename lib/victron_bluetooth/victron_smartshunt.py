@@ -1,6 +1,3 @@
-from lib.victron_bluetooth.victron_gatt import gatt_device_instance
-
-
 class Smartshunt:
     HASS_MAPPING_TABLE = [0xFE, 0xFF, 0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x09, 0x0A, 0x0B, 0x0E,
                           0x0F, 0x10, 0x11, 0x8C, 0x8D, 0x8E, 0x7D]
@@ -34,13 +31,21 @@ class Smartshunt:
     def get_mapping_table(self):
         return self.HASS_MAPPING_TABLE
 
-    def get_gatt_device_instance(self, manager, handle_single_value, handle_bulk_values, options):
-        UUID_FUNCTION_TABLE = {
+    def get_notification_table(self, handle_single_value, handle_bulk_values):
+        """
+        :return: {characteristic uuid: handler function}
+        """
+        return {
             self.handle_uuid_map["0027"]: handle_bulk_values,
             self.handle_uuid_map["0024"]: handle_single_value,
             self.handle_uuid_map["0021"]: handle_single_value,
         }
 
+    def get_gatt_device_instance(self, manager, handle_single_value, handle_bulk_values, options):
+        from lib.victron_bluetooth.victron_gatt import gatt_device_instance
+
+        UUID_FUNCTION_TABLE = self.get_notification_table(handle_single_value, handle_bulk_values)
+
         self.gatt_device = gatt_device_instance(
             manager,
             self.config['mac'],
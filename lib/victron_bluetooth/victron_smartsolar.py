@@ -1,6 +1,3 @@
-from lib.victron_bluetooth.victron_gatt import gatt_device_instance
-
-
 class Smartsolar:
     HASS_MAPPING_TABLE = [0x8F, 0xBC, 0xBD, 0xBB]
 
@@ -61,14 +58,22 @@ class Smartsolar:
     def get_mapping_table(self):
         return self.HASS_MAPPING_TABLE
 
-    def get_gatt_device_instance(self, manager, handle_single_value, handle_bulk_values, options):
-        UUID_FUNCTION_TABLE = {
+    def get_notification_table(self, handle_single_value, handle_bulk_values):
+        """
+        :return: {characteristic uuid: handler function}
+        """
+        return {
             self.handle_uuid_map["0027"]: handle_bulk_values,
             self.handle_uuid_map["0024"]: handle_single_value,
             self.handle_uuid_map["0021"]: handle_single_value,
             # handle_uuid_map["0021"]: handle_single_value, # only f901 - answer to f941?!
         }
 
+    def get_gatt_device_instance(self, manager, handle_single_value, handle_bulk_values, options):
+        from lib.victron_bluetooth.victron_gatt import gatt_device_instance
+
+        UUID_FUNCTION_TABLE = self.get_notification_table(handle_single_value, handle_bulk_values)
+
         return gatt_device_instance(
             manager,
             self.config['mac'],
@@ -0,0 +1,83 @@
+import lib.helper as helper
+
+STATISTICS = ('mean', 'min', 'max', 'last')
+AGGREGATE_CATEGORY = 'Latest'
+
+
+class FieldStatistic:
+    """
+    Running statistic of one numeric field, constant memory for any window length
+    """
+    __slots__ = ('min', 'max', 'sum', 'count', 'last')
+
+    def __init__(self, value):
+        self.min = value
+        self.max = value
+        self.sum = value
+        self.count = 1
+        self.last = value
+
+    def add(self, value):
+        if value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.sum += value
+        self.count += 1
+        self.last = value
+
+    def get(self, statistic):
+        if statistic == 'mean':
+            # raw values are integers in the smallest unit (mV, mA, ...), so rounding loses nothing visible
+            return round(self.sum / self.count)
+        return getattr(self, statistic)
+
+
+class WindowAggregator:
+    """
+    Aggregates all text blocks between two timer ticks into one block.
+    Numeric fields of the Latest category get the configured statistic, all other fields keep their last value.
+    """
+
+    def __init__(self, value_map, statistic='mean'):
+        """
+        :param value_map: value_description_map of the device
+        :param statistic: mean, min, max or last
+        """
+        if statistic not in STATISTICS:
+            raise ValueError(f'Unknown aggregate {statistic}, possible values: {", ".join(STATISTICS)}')
+        self.statistic = statistic
+        self.numeric = {key for key, entry in value_map.items()
+                        if entry[0] == AGGREGATE_CATEGORY and entry[4] is helper.convert_int_factor}
+        self.fields = {}
+        self.statistics = {}
+        self.blocks = 0
+
+    def add(self, packet):
+        """
+        :param packet: Block from VedirectParser, {key: value}
+        """
+        self.blocks += 1
+        self.fields.update(packet)
+        for key in self.numeric.intersection(packet):
+            try:
+                value = int(packet[key])
+            except ValueError:
+                continue
+            statistic = self.statistics.get(key)
+            if statistic is None:
+                self.statistics[key] = FieldStatistic(value)
+            else:
+                statistic.add(value)
+
+    def flush(self):
+        """
+        :return: Aggregated block of the window, values are strings like in the text protocol
+        """
+        packet = self.fields
+        for key, statistic in self.statistics.items():
+            packet[key] = str(statistic.get(self.statistic))
+        self.fields = {}
+        self.statistics = {}
+        self.blocks = 0
+        return packet
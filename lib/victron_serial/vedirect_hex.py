@@ -0,0 +1,148 @@
+import logging
+import time
+
+logger = logging.getLogger()
+
+# Frame: ":" <command nibble> <data bytes as hex> <checksum byte as hex> "\n"
+# The command nibble plus all data bytes plus the checksum byte is 0x55 (modulo 256)
+CHECKSUM_TARGET = 0x55
+
+COMMAND_DONE = 0x1
+COMMAND_UNKNOWN = 0x3
+COMMAND_ERROR = 0x4
+COMMAND_PING = 0x5
+COMMAND_GET = 0x7
+COMMAND_SET = 0x8
+COMMAND_ASYNC = 0xA
+
+# Flags byte of get/set/async replies
+FLAG_UNKNOWN = 0x01
+FLAG_NOT_SUPPORTED = 0x02
+FLAG_PARAMETER_ERROR = 0x04
+FLAGS = {
+    FLAG_UNKNOWN: 'unknown register',
+    FLAG_NOT_SUPPORTED: 'not supported',
+    FLAG_PARAMETER_ERROR: 'parameter error',
+}
+
+
+def build_frame(command, data=b''):
+    """
+    :param command: Command nibble
+    :param data: Payload bytes
+    :return: Complete frame including ":" and "\\n"
+    """
+    checksum = (CHECKSUM_TARGET - command - sum(data)) & 0xFF
+    return f':{command:X}{data.hex().upper()}{checksum:02X}\n'.encode('ascii')
+
+
+def parse_frame(frame):
+    """
+    :param frame: Frame without ":" and "\\n", as delivered by VedirectParser
+    :return: (command, data bytes without checksum)
+    """
+    try:
+        command = int(frame[:1], 16)
+        data = bytes.fromhex(frame[1:].decode('ascii'))
+    except ValueError:
+        raise ValueError(f'Invalid HEX frame: {frame}')
+    if not data or (command + sum(data)) & 0xFF != CHECKSUM_TARGET:
+        raise ValueError(f'Checksum error in HEX frame: {frame}')
+    return command, data[:-1]
+
+
+def get_frame(register):
+    return build_frame(COMMAND_GET, register.to_bytes(2, 'little') + b'\x00')
+
+
+def set_frame(register, value, length, signed=False):
+    return build_frame(COMMAND_SET, register.to_bytes(2, 'little') + b'\x00' +
+                       value.to_bytes(length, 'little', signed=signed))
+
+
+class VedirectHex:
+    """
+    Client for the VE.Direct HEX protocol, which runs on the same port as the text protocol.
+    Registers are polled with get commands in their own interval, replies and asynchronous messages of the device
+    arrive as HEX frames from VedirectParser and are handed to handle_frame.
+    """
+
+    def __init__(self, ser, register_map, poll_config, value_callback):
+        """
+        :param ser: serial.Serial
+        :param register_map: {register: (key, signed, factor)}, see hex_register_map of the device modules
+        :param poll_config: {register: interval in seconds}
+        :param value_callback: Function(key, value), value is converted to the unit of the text protocol
+        """
+        self.ser = ser
+        self.register_map = register_map
+        self.poll_config = poll_config
+        self.value_callback = value_callback
+        self.next_poll = {register: 0 for register in poll_config}
+        self.pending = {}
+        self.timeouts = 0
+        self.errors = 0
+
+    def poll(self, now=None):
+        """
+        Sends a get command for every register whose interval elapsed, called from the reader loop
+        """
+        if now is None:
+            now = time.monotonic()
+        for register, next_poll in self.next_poll.items():
+            if now < next_poll:
+                continue
+            if register in self.pending:
+                self.timeouts += 1
+                logger.debug(f'HEX: no reply for register 0x{register:04X}')
+            self.next_poll[register] = now + self.poll_config[register]
+            self.pending[register] = now
+            self.ser.write(get_frame(register))
+
+    def get(self, register):
+        self.pending[register] = time.monotonic()
+        self.ser.write(get_frame(register))
+
+    def set(self, register, value, length, signed=False):
+        self.ser.write(set_frame(register, value, length, signed))
+
+    def handle_frame(self, frame):
+        """
+        :param frame: HEX frame without ":" and "\\n"
+        """
+        try:
+            command, data = parse_frame(frame)
+        except ValueError as e:
+            self.errors += 1
+            logger.debug(f'HEX: {e}')
+            return
+
+        if command not in (COMMAND_GET, COMMAND_SET, COMMAND_ASYNC):
+            if command in (COMMAND_UNKNOWN, COMMAND_ERROR):
+                self.errors += 1
+                logger.warning(f'HEX: device answered with {"unknown command" if command == COMMAND_UNKNOWN else "error"}')
+            return
+        if len(data) < 3:
+            self.errors += 1
+            logger.debug(f'HEX: reply too short: {frame}')
+            return
+
+        register = int.from_bytes(data[0:2], 'little')
+        flags = data[2]
+        self.pending.pop(register, None)
+        if flags:
+            self.errors += 1
+            reasons = ', '.join(reason for flag, reason in FLAGS.items() if flags & flag)
+            logger.warning(f'HEX: register 0x{register:04X}: {reasons or f"flags 0x{flags:02X}"}')
+            if flags & (FLAG_UNKNOWN | FLAG_NOT_SUPPORTED) and self.next_poll.pop(register, None) is not None:
+                logger.warning(f'HEX: stop polling register 0x{register:04X}')
+            return
+
+        if register not in self.register_map:
+            # asynchronous messages also contain registers we do not know
+            logger.debug(f'HEX: ignoring register 0x{register:04X}')
+            return
+        key, signed, factor = self.register_map[register]
+        raw = int.from_bytes(data[3:], 'little', signed=signed)
+        # values are handed over like the text protocol sends them
+        self.value_callback(key, str(round(raw * factor)))
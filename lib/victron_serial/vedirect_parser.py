@@ -0,0 +1,144 @@
+import logging
+
+logger = logging.getLogger()
+
+# A block is a sequence of "\r\n<label>\t<value>" fields, closed by "\r\nChecksum\t<byte>".
+# The sum of all bytes of a block including the checksum byte is 0 (modulo 256).
+FIELD_START = b'\r\n'
+LABEL_END = '\t'
+CHECKSUM_FIELD = b'\r\nChecksum\t'
+# HEX protocol frames (":<hex digits>\n") may be sent in between and are not part of the checksum
+HEX_START = b':'
+HEX_END = b'\n'
+
+MAX_BUFFER = 4096
+
+
+def split_hex_frames(data, keep_incomplete=False):
+    """
+    Removes HEX frames from text data
+    :param data: bytes-like
+    :param keep_incomplete: Keep an incomplete frame at the end in the text, more bytes may complete it
+    :return: (text without HEX frames, list of HEX frames without ":" and "\n")
+    """
+    text = bytearray()
+    frames = []
+    pos = 0
+    while True:
+        start = data.find(HEX_START, pos)
+        if start < 0:
+            text += data[pos:]
+            return text, frames
+        end = data.find(HEX_END, start)
+        if end < 0:
+            text += data[pos:] if keep_incomplete else data[pos:start]
+            return text, frames
+        text += data[pos:start]
+        frames.append(bytes(data[start + 1:end]))
+        pos = end + 1
+
+
+class VedirectParser:
+    """
+    Incremental parser for the VE.Direct text protocol.
+    Consumes chunks of bytes and only looks at a block once its checksum field arrived. The checksum is summed and
+    the fields are split with C level bytes/str methods instead of a per-byte state machine.
+    Blocks are only emitted if their checksum is valid, HEX frames in between are handed to hex_callback.
+    """
+
+    def __init__(self, hex_callback=None):
+        self.buffer = bytearray()
+        self.hex_callback = hex_callback
+        self.blocks = 0
+        self.checksum_errors = 0
+        self.hex_frames = 0
+        self.dropped = 0
+
+    def feed(self, data):
+        """
+        :param data: bytes read from the port
+        :return: List of completed blocks, each a dict {label: value}
+        """
+        buffer = self.buffer
+        buffer += data
+        blocks = []
+        pos = 0
+        while True:
+            end = buffer.find(CHECKSUM_FIELD, pos)
+            if end < 0:
+                break
+            # the checksum byte may be any byte, even "\r" or ":"
+            end += len(CHECKSUM_FIELD) + 1
+            if end > len(buffer):
+                break
+            self.finish_block(buffer[pos:end], blocks)
+            pos = end
+        del buffer[:pos]
+
+        # the remaining bytes contain no checksum byte, so every ":" starts a HEX frame
+        if HEX_START in buffer:
+            self.buffer, frames = split_hex_frames(buffer, keep_incomplete=True)
+            self.handle_hex(frames)
+
+        if len(self.buffer) > MAX_BUFFER:
+            logger.debug(f'VE.Direct: dropping {len(self.buffer)} bytes without checksum field')
+            self.dropped += len(self.buffer)
+            self.buffer.clear()
+        return blocks
+
+    def finish_block(self, block, blocks):
+        """
+        :param block: Bytes from the end of the previous block up to and including the checksum byte
+        :param blocks: List the decoded block is appended to
+        """
+        if HEX_START in block[:-1]:
+            text, frames = split_hex_frames(block[:-1])
+            self.handle_hex(frames)
+            block = text + block[-1:]
+
+        if sum(block) & 0xFF:
+            # also the first block after start, if reading started within the block
+            self.checksum_errors += 1
+            logger.debug(f'VE.Direct: checksum error, dropping block: {bytes(block)}')
+            return
+
+        start = block.find(FIELD_START) + len(FIELD_START)
+        lines = block[start:-len(CHECKSUM_FIELD) - 1].decode('ascii', 'replace').split('\r\n')
+        fields = {}
+        for line in lines:
+            label, _, value = line.partition(LABEL_END)
+            fields[label] = value
+        self.blocks += 1
+        blocks.append(fields)
+
+    def handle_hex(self, frames):
+        for frame in frames:
+            self.hex_frames += 1
+            if self.hex_callback is not None:
+                self.hex_callback(frame)
+
+
+class VedirectReader:
+    """
+    Reads chunks from a serial port until stopped
+    """
+
+    def __init__(self, ser, chunk_callback):
+        """
+        :param ser: serial.Serial, read timeout should be short to be able to stop
+        :param chunk_callback: Function(bytes)
+        """
+        self.ser = ser
+        self.chunk_callback = chunk_callback
+        self.keep_running = False
+
+    def run(self):
+        self.keep_running = True
+        while self.keep_running:
+            # One call reads everything the OS buffered, if nothing is buffered it blocks for the next byte
+            data = self.ser.read(self.ser.in_waiting or 1)
+            if data:
+                self.chunk_callback(data)
+
+    def stop(self):
+        self.keep_running = False
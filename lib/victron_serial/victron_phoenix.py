@@ -17,3 +17,13 @@ value_description_map = {
     'CS': ("Latest", "Status", "", CS, helper.convert_map_out),
     'PROD': ("Meta", "Production Date", "", 0, helper.convert_production_date),
 }
+
+# Registers for the HEX protocol, values are converted to the units of the text protocol
+# MAP: REGISTER: (Key in value_description_map, Signed?, Factor)
+hex_register_map = {
+    0xED8D: ('V', True, 10),        # 0.01 V
+    0x2200: ('AC_OUT_V', True, 1),  # 0.01 V
+    0x2201: ('AC_OUT_I', True, 1),  # 0.1 A
+    0x0200: ('MODE', False, 1),
+    0x0201: ('CS', False, 1),
+}
@@ -1,51 +1,84 @@
 import logging
 import time
 import threading
-from vedirect import Vedirect
+import lib.metrics as metrics
+from lib.capture import KIND_SERIAL
+from lib.victron_serial.vedirect_parser import VedirectParser, VedirectReader
 
 logger = logging.getLogger()
 
-# hack! patch vedirect's read_data_callback method to support exiting the main loop
-
-#vedirect.read_data_callback = lambda self, callbackFunction:
-def read_data_callback(self, callbackFunction):
-    self.keep_running = True
-    while self.keep_running:
-        data = self.ser.read()
-        for byte in data:
-            packet = self.input(byte)
-            if (packet != None):
-                callbackFunction(packet)
-Vedirect.read_data_callback = read_data_callback
+BAUDRATE = 19200
+# short read timeout, so the reader thread notices a shutdown
+READ_TIMEOUT = 2
 
 class VictronSerial:
-    def __init__(self, device_config, output_callback):
+    def __init__(self, device_config, output_callback, flush_callback):
         self.device_config = device_config
         self.output_callback = output_callback
+        self.flush_callback = flush_callback
         self.name = device_config['name']
         self.type = device_config['type']
-        self.port = device_config['port']
+        # without port, data is only given to feed(), e.g. from a recorded capture
+        self.port = device_config.get('port')
 
         if self.type == 'phoenix':
-            from lib.victron_serial.victron_phoenix import value_description_map
+            from lib.victron_serial.victron_phoenix import value_description_map, hex_register_map
         elif self.type == 'smartshunt':
-            from lib.victron_serial.victron_smartshunt import value_description_map
+            from lib.victron_serial.victron_smartshunt import value_description_map, hex_register_map
         elif self.type == 'smartsolar':
-            from lib.victron_serial.victron_smartsolar import value_description_map
+            from lib.victron_serial.victron_smartsolar import value_description_map, hex_register_map
         else:
             raise RuntimeError(f'Got unknown type ({self.type}) from config!')
         self.map = value_description_map
+        self.hex_register_map = hex_register_map
 
-        self.ve = Vedirect(self.port, 60)
-        callback_wrapper = lambda packet: self.read_data_callback(packet)
-        self.thread = threading.Thread(target=self.ve.read_data_callback, args=(callback_wrapper,))
-        self.thread.start()
-        # TODO: stop this thread when the application quits
-
+        # CaptureWriter, records the raw chunks
+        self.recorder = None
+        self.frames_received = metrics.SERIAL_FRAMES_RECEIVED.labels(self.name)
+        self.checksum_errors = metrics.SERIAL_CHECKSUM_ERRORS.labels(self.name)
+        self.frames_processed = metrics.SERIAL_FRAMES_PROCESSED.labels(self.name)
         self.last_packet = None
         self.last_packet_ready = threading.Event()
         self.timer_elapsed = True
 
+        self.aggregator = None
+        if device_config.get('aggregate'):
+            from lib.victron_serial.aggregator import WindowAggregator
+            self.aggregator = WindowAggregator(self.map, device_config['aggregate'])
+
+        self.ser = None
+        self.reader = None
+        self.thread = None
+        if self.port is not None:
+            import serial
+            self.ser = serial.Serial(self.port, BAUDRATE, timeout=READ_TIMEOUT)
+        self.hex = None
+        self.hex_keys = set()
+        if device_config.get('hex_poll') and self.ser is not None:
+            self.hex = self.create_hex_client(device_config['hex_poll'])
+        self.parser = VedirectParser(self.hex.handle_frame if self.hex else None)
+        if self.ser is not None:
+            self.reader = VedirectReader(self.ser, self.feed)
+            self.thread = threading.Thread(target=self.reader.run, name=f'{self.name}-reader', daemon=True)
+            self.thread.start()
+
+    def create_hex_client(self, hex_poll):
+        """
+        :param hex_poll: {value description: interval in seconds} from the device config
+        :return: VedirectHex
+        """
+        from lib.victron_serial.vedirect_hex import VedirectHex
+        registers = {key: register for register, (key, _, _) in self.hex_register_map.items()}
+        poll_config = {}
+        for description, interval in hex_poll.items():
+            key = next((key for key, entry in self.map.items() if entry[1] == description), None)
+            if key not in registers:
+                logger.warning(f'{self.name}: {description} can not be polled with the HEX protocol')
+                continue
+            poll_config[registers[key]] = interval
+            self.hex_keys.add(key)
+        return VedirectHex(self.ser, self.hex_register_map, poll_config, self.send_out)
+
     def get_device_info(self):
         data = None
         while data is None:
@@ -88,23 +121,53 @@ class VictronSerial:
                 self.timer_elapsed = True
 
     def shutdown(self):
-        if hasattr(self.ve, 'keep_running'):
+        if self.reader is not None and self.reader.keep_running:
             logging.info(f'Shutting down {self.name} thread')
-            self.ve.keep_running = False
+            self.reader.stop()
             self.thread.join()
+            self.ser.close()
+
+    def feed(self, data):
+        """
+        :param data: bytes read from the port
+        """
+        if self.recorder is not None:
+            self.recorder.record(KIND_SERIAL, data)
+        checksum_errors = self.parser.checksum_errors
+        packets = self.parser.feed(data)
+        if packets:
+            self.frames_received.inc(len(packets))
+        if self.parser.checksum_errors != checksum_errors:
+            self.checksum_errors.inc(self.parser.checksum_errors - checksum_errors)
+        for packet in packets:
+            self.read_data_callback(packet)
+        if self.hex is not None:
+            self.hex.poll()
+        self.flush_callback()
 
     def read_data_callback(self, packet):
-        logger.debug(f'Got data from port {self.port}: {packet}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Got data from port {self.port}: {packet}')
         self.last_packet = packet
         self.last_packet_ready.set()
 
+        if self.aggregator is not None:
+            self.aggregator.add(packet)
         if self.timer_elapsed:
             self.timer_elapsed = False
+            if self.aggregator is not None:
+                logger.debug(f'{self.name}: Aggregated {self.aggregator.blocks} blocks')
+                packet = self.aggregator.flush()
             self.process_packet(packet)
 
     def process_packet(self, packet):
-        logger.debug(f'Processing packet with {len(packet)} items')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Processing packet with {len(packet)} items')
+        self.frames_processed.inc()
         for key, value in packet.items():
+            # values polled with the HEX protocol are sent when their reply arrives
+            if key in self.hex_keys:
+                continue
             # for devices with a serial number, extract the production date as additional property
             if key == 'SER#':
                 self.send_out('PROD', value)
@@ -40,3 +40,31 @@ value_description_map = {
     'FW': ("Meta", "Firmware Version", "", "", helper.convert_firmware),
     'MON': ("Meta", "MON ?", "", "", helper.convert_str_out),
 }
+
+# Registers for the HEX protocol, values are converted to the units of the text protocol
+# MAP: REGISTER: (Key in value_description_map, Signed?, Factor)
+hex_register_map = {
+    0xED8D: ('V', True, 10),       # 0.01 V
+    0xED7D: ('VS', False, 10),     # 0.01 V
+    0xED8F: ('I', True, 100),      # 0.1 A
+    0xED8E: ('P', True, 1),        # 1 W
+    0xEEFF: ('CE', True, 100),     # 0.1 Ah
+    0x0FFF: ('SOC', False, 0.1),   # 0.01 %
+    0x0FFE: ('TTG', False, 1),     # 1 min
+    0x0300: ('H1', True, 100),     # 0.1 Ah
+    0x0301: ('H2', True, 100),     # 0.1 Ah
+    0x0302: ('H3', True, 100),     # 0.1 Ah
+    0x0303: ('H4', False, 1),
+    0x0304: ('H5', False, 1),
+    0x0305: ('H6', True, 100),     # 0.1 Ah
+    0x0306: ('H7', True, 10),      # 0.01 V
+    0x0307: ('H8', True, 10),      # 0.01 V
+    0x0308: ('H9', False, 1),      # 1 s
+    0x0309: ('H10', False, 1),
+    0x030A: ('H11', False, 1),
+    0x030B: ('H12', False, 1),
+    0x030E: ('H15', True, 10),     # 0.01 V
+    0x030F: ('H16', True, 10),     # 0.01 V
+    0x0310: ('H17', False, 1),     # 0.01 kWh
+    0x0311: ('H18', False, 1),     # 0.01 kWh
+}
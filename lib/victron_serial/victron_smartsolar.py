@@ -28,3 +28,20 @@ value_description_map = {
     'SER#': ("Meta", "Serial", "", 0, helper.convert_str_out),
     'PROD': ("Meta", "Production Date", "", 0, helper.convert_production_date),
 }
+
+# Registers for the HEX protocol, values are converted to the units of the text protocol
+# MAP: REGISTER: (Key in value_description_map, Signed?, Factor)
+hex_register_map = {
+    0xEDD5: ('V', False, 10),      # 0.01 V
+    0xEDD7: ('I', False, 100),     # 0.1 A
+    0xEDAD: ('IL', False, 100),    # 0.1 A
+    0xEDBB: ('VPV', False, 10),    # 0.01 V
+    0xEDBC: ('PPV', False, 0.01),  # 0.01 W
+    0x0201: ('CS', False, 1),
+    0xEDDA: ('ERR', False, 1),
+    0xEDDC: ('H19', False, 1),     # 0.01 kWh
+    0xEDD3: ('H20', False, 1),     # 0.01 kWh
+    0xEDD2: ('H21', False, 1),     # 1 W
+    0xEDD1: ('H22', False, 1),     # 0.01 kWh
+    0xEDD0: ('H23', False, 1),     # 1 W
+}
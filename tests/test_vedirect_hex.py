@@ -0,0 +1,174 @@
+import os
+import select
+import threading
+import time
+import tty
+import pytest
+from lib.simulator.vedirect import encode_block
+from lib.victron_serial.vedirect_hex import (VedirectHex, build_frame, parse_frame, COMMAND_GET, COMMAND_SET,
+                                             COMMAND_UNKNOWN, FLAG_UNKNOWN)
+from lib.victron_serial.vedirect_parser import VedirectParser
+from lib.victron_serial.victron_smartshunt import hex_register_map
+
+# register: (raw value, length in bytes, signed)
+REGISTERS = {
+    0xED8D: (1326, 2, True),      # V 13.26 V
+    0xED8F: (-774, 4, True),      # I -77.4 A
+    0x0FFF: (9900, 2, False),     # SOC 99 %
+    0xEEFF: (-291, 4, True),      # CE -29.1 Ah
+}
+# the fake device answers this register with a wrong checksum
+BAD_CHECKSUM_REGISTER = 0x0FFE
+
+
+class FakeDevice:
+    """
+    Answers HEX get and set commands on the master side of a pty pair, sends a text block after every reply
+    """
+
+    def __init__(self, registers):
+        self.registers = dict(registers)
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.received = []
+        self.keep_running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        buffer = b''
+        while self.keep_running:
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            buffer += os.read(self.master, 1024)
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self.answer(line[line.index(b':') + 1:])
+
+    def answer(self, frame):
+        command, data = parse_frame(frame)
+        self.received.append((command, data))
+        register = int.from_bytes(data[0:2], 'little')
+        if command == COMMAND_SET and register in self.registers:
+            _, length, signed = self.registers[register]
+            self.registers[register] = (int.from_bytes(data[3:], 'little', signed=signed), length, signed)
+        if command not in (COMMAND_GET, COMMAND_SET):
+            reply = build_frame(COMMAND_UNKNOWN)
+        elif register == BAD_CHECKSUM_REGISTER:
+            reply = bytearray(build_frame(command, data[0:2] + b'\x00' + (120).to_bytes(2, 'little')))
+            reply[-3:-1] = b'00' if reply[-3:-1] != b'00' else b'01'
+            reply = bytes(reply)
+        elif register not in self.registers:
+            reply = build_frame(command, data[0:2] + bytes([FLAG_UNKNOWN]))
+        else:
+            value, length, signed = self.registers[register]
+            reply = build_frame(command, data[0:2] + b'\x00' + value.to_bytes(length, 'little', signed=signed))
+        # the text protocol keeps running, replies arrive in between
+        os.write(self.master, reply + encode_block([('V', '13260'), ('I', '-7740')]))
+
+    def close(self):
+        self.keep_running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+class Port:
+    """
+    Serial port on the slave side of the pty, only what VedirectHex uses
+    """
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        os.write(self.fd, data)
+
+
+@pytest.fixture
+def device():
+    fake = FakeDevice(REGISTERS)
+    yield fake
+    fake.close()
+
+
+@pytest.fixture
+def client(device):
+    values = {}
+    hex_client = VedirectHex(Port(device.slave), hex_register_map, {}, values.__setitem__)
+    parser = VedirectParser(hex_client.handle_frame)
+    blocks = []
+
+    def read(until, timeout=2):
+        """
+        Reads from the port until until() is true
+        """
+        deadline = time.monotonic() + timeout
+        while not until() and time.monotonic() < deadline:
+            readable, _, _ = select.select([device.slave], [], [], 0.05)
+            if readable:
+                blocks.extend(parser.feed(os.read(device.slave, 1024)))
+        assert until(), 'no reply from fake device'
+
+    return hex_client, parser, values, blocks, read
+
+
+def test_get_registers(client):
+    hex_client, parser, values, blocks, read = client
+    for register in REGISTERS:
+        hex_client.get(register)
+    read(lambda: len(values) == len(REGISTERS))
+    assert values == {'V': '13260', 'I': '-77400', 'SOC': '990', 'CE': '-29100'}
+    assert hex_client.pending == {}
+    assert hex_client.errors == 0
+    # the text blocks around the replies are still decoded
+    read(lambda: len(blocks) == len(REGISTERS))
+    assert blocks[0] == {'V': '13260', 'I': '-7740'}
+    assert parser.checksum_errors == 0
+
+
+def test_set_register(client, device):
+    hex_client, parser, values, blocks, read = client
+    hex_client.set(0x0FFF, 5000, 2)
+    read(lambda: 'SOC' in values)
+    assert values['SOC'] == '500'
+    assert device.received[0] == (COMMAND_SET, bytes([0xFF, 0x0F, 0x00]) + (5000).to_bytes(2, 'little'))
+
+    values.clear()
+    hex_client.get(0x0FFF)
+    read(lambda: 'SOC' in values)
+    assert values['SOC'] == '500'
+
+
+def test_poll_interval(client, device):
+    hex_client, parser, values, blocks, read = client
+    hex_client.poll_config = {0xED8D: 10}
+    hex_client.next_poll = {0xED8D: 0}
+    hex_client.poll(now=100)
+    hex_client.poll(now=105)
+    read(lambda: 'V' in values)
+    assert [data[0:2] for _, data in device.received] == [bytes([0x8D, 0xED])]
+    hex_client.poll(now=110)
+    read(lambda: len(device.received) == 2)
+
+
+def test_bad_checksum_reply(client):
+    hex_client, parser, values, blocks, read = client
+    hex_client.get(BAD_CHECKSUM_REGISTER)
+    read(lambda: hex_client.errors == 1)
+    assert 'TTG' not in values
+    # no reply, polled again on the next interval
+    assert BAD_CHECKSUM_REGISTER in hex_client.pending
+    assert parser.hex_frames == 1
+
+
+def test_unknown_register_stops_polling(client):
+    hex_client, parser, values, blocks, read = client
+    hex_client.poll_config = {0x0300: 60}
+    hex_client.next_poll = {0x0300: 0}
+    hex_client.poll(now=1)
+    read(lambda: hex_client.errors == 1)
+    assert values == {}
+    assert hex_client.next_poll == {}
@@ -0,0 +1,99 @@
+import os
+import pytest
+from lib.simulator.fixtures import FIXTURES
+from lib.simulator.vedirect import encode_block
+from lib.victron_serial.vedirect_parser import VedirectParser
+
+# fixture: number of blocks
+STREAMS = {
+    'vedirect_phoenix.bin': 60,
+    'vedirect_smartshunt.bin': 90,
+    'vedirect_smartsolar.bin': 60,
+}
+
+
+def load(name):
+    with open(os.path.join(FIXTURES, name), 'rb') as fixture:
+        return fixture.read()
+
+
+def feed_chunks(parser, data, size):
+    blocks = []
+    for pos in range(0, len(data), size):
+        blocks += parser.feed(data[pos:pos + size])
+    return blocks
+
+
+@pytest.mark.parametrize('name, count', STREAMS.items())
+def test_block_count(name, count):
+    parser = VedirectParser()
+    blocks = parser.feed(load(name))
+    assert len(blocks) == count
+    assert parser.blocks == count
+    assert parser.checksum_errors == 0
+    assert parser.buffer == b''
+
+
+@pytest.mark.parametrize('name', STREAMS)
+@pytest.mark.parametrize('size', [1, 2, 7, 64, 1000])
+def test_chunk_size_does_not_change_result(name, size):
+    data = load(name)
+    expected = VedirectParser().feed(data)
+    parser = VedirectParser()
+    assert feed_chunks(parser, data, size) == expected
+    assert parser.checksum_errors == 0
+
+
+def test_block_fields():
+    blocks = VedirectParser().feed(load('vedirect_phoenix.bin'))
+    assert blocks[0]['PID'] == '0xA261'
+    assert blocks[0]['SER#'] == 'HQ1936HGQYH'
+    assert set(blocks[0]) == {'PID', 'FW', 'SER#', 'MODE', 'CS', 'AC_OUT_V', 'AC_OUT_I', 'V', 'AR', 'WARN'}
+
+
+def test_wrong_checksum_drops_block():
+    good = encode_block([('V', '13230'), ('I', '100')])
+    bad = bytearray(encode_block([('V', '13231'), ('I', '100')]))
+    bad[-1] = (bad[-1] + 1) & 0xFF
+    parser = VedirectParser()
+    blocks = parser.feed(good + bytes(bad) + good)
+    assert blocks == [{'V': '13230', 'I': '100'}] * 2
+    assert parser.checksum_errors == 1
+    assert parser.blocks == 2
+
+
+def test_checksum_errors_counted_in_capture():
+    data = bytearray(load('vedirect_smartsolar.bin'))
+    # corrupt a value in the first and the last block
+    data[data.find(b'\r\nV\t') + 4] ^= 0x01
+    data[data.rfind(b'\r\nV\t') + 4] ^= 0x01
+    parser = VedirectParser()
+    blocks = parser.feed(data)
+    assert parser.checksum_errors == 2
+    assert len(blocks) == 58
+
+
+@pytest.mark.parametrize('size', [1, 3, 1000])
+def test_hex_frames_inside_text_block(size):
+    block = encode_block([('V', '13230'), ('I', '100'), ('SOC', '990')])
+    # HEX frames may be sent in the middle of a block, they are not part of its checksum
+    first = block.find(b'\r\nI\t')
+    second = block.find(b'\r\nChecksum')
+    data = block[:first] + b':A8DED000A30\n' + block[first:second] + b':7F0ED0064000A\n' + block[second:]
+    frames = []
+    parser = VedirectParser(hex_callback=frames.append)
+    blocks = feed_chunks(parser, data, size)
+    assert blocks == [{'V': '13230', 'I': '100', 'SOC': '990'}]
+    assert frames == [b'A8DED000A30', b'7F0ED0064000A']
+    assert parser.hex_frames == 2
+    assert parser.checksum_errors == 0
+
+
+@pytest.mark.parametrize('checksum', [b':', b'\r', b'\n'])
+def test_checksum_byte_looks_like_separator(checksum):
+    candidates = (encode_block([(label, str(value))]) for label in ('V', 'I', 'P', 'CE', 'SOC', 'VPV', 'AC_OUT_V')
+                  for value in range(1000))
+    block = next(block for block in candidates if block[-1:] == checksum)
+    parser = VedirectParser()
+    assert len(feed_chunks(parser, block * 3, 1)) == 3
+    assert parser.checksum_errors == 0
@@ -5,8 +5,7 @@ import faulthandler
 import json
 import logging
 import os
-import queue
-import subprocess
+import signal
 import sys
 import threading
 import time
@@ -18,12 +17,18 @@ from time import sleep
 
 version = 0.1
 
+HASS_STATUS_TOPIC = 'homeassistant/status'
+
 
 def victron_thread(thread_count, config, vdevice_config, thread_q):
     from lib.victron import Victron
-    v = Victron(config, vdevice_config, output, args, thread_count, thread_q)
+    v = Victron(config, vdevice_config, output, args, thread_count, thread_q, len(devices_config))
     logger.debug("victron library loaded, start connect_diconnect_loop()")
-    v.connect_disconnect_loop()
+    try:
+        v.connect_disconnect_loop()
+    finally:
+        # the supervisor creates a new instance on restart, the timers and threads of this one must stop
+        v.close()
 
 
 def output_print(device_name, category, value, hass_config=False, vunit=None):
@@ -49,25 +54,47 @@ def output_json(device_name, category, value, hass_config=False, vunit=None):
 
 def output_syslog(device_name, category, value, hass_config=False, vunit=None):
     if type(value) == dict:
+        # a whole collection is sent as one message
         map = {}
         map[category] = value
         return_data = json.dumps(map)
     else:
         return_data = f"{device_name}|{category}:{value}"
 
-    subprocess.run(
-        [
-            "/usr/bin/logger",
-            f"--id={os.getpid()}",
-            "-t",
-            "victron",
-            return_data,
-        ]
-    )
+    syslog_sink.send(return_data)
+
+
+def output_ndjson(device_name, category, value, hass_config=False, vunit=None):
+    record = {
+        'time': f'{datetime.now():%Y-%m-%d %H:%M:%S.%f}',
+        'device': device_name,
+    }
+    if category is None:
+        # batch of values
+        record['values'] = value
+    elif type(value) == dict:
+        record['collection'] = category
+        record['values'] = value
+    else:
+        record['name'] = category
+        record['value'] = value
+        record['unit'] = vunit
+    ndjson_sink.write(record)
 
 
 def mqtt_onconnect(client, userdata, flags, rc):
     client.publish(mqtt_lwt, payload=1, qos=0, retain=True)
+    if config['mqtt']['hass']:
+        client.subscribe(HASS_STATUS_TOPIC)
+
+
+def mqtt_onmessage(client, userdata, message):
+    if message.topic == HASS_STATUS_TOPIC and message.payload == b'online':
+        # homeassistant restarted, publish the discovery configs again in case the broker lost them
+        from lib.hass_discovery import get_discovery, DEFAULT_CACHE_FILE
+        # may arrive before a device created the discovery manager
+        discovery = get_discovery(config['mqtt'].get('hass_cache', DEFAULT_CACHE_FILE))
+        threading.Thread(target=discovery.republish, name='hass-republish', daemon=True).start()
 
 
 def output_mqtt(device_name, subtopic, value, hass_config=False, vunit=None):
@@ -79,6 +106,10 @@ def output_mqtt(device_name, subtopic, value, hass_config=False, vunit=None):
         pub = f'{subtopic}'
         data = value
         retain = True
+    elif subtopic is None:
+        # batch of values
+        pub = f'{config["mqtt"]["base_topic"]}/{device_name}'
+        data = json.dumps(value)
     else:
         if value == "":
             pub = f'{config["mqtt"]["base_topic"]}/{device_name}'
@@ -90,7 +121,7 @@ def output_mqtt(device_name, subtopic, value, hass_config=False, vunit=None):
             else:
                 data = value
 
-    client.publish(pub, data, retain=retain)
+    return client.publish(pub, data, retain=retain)
 
 
 def get_helper_string_device(devices):
@@ -101,7 +132,7 @@ def get_helper_string_device(devices):
 
 
 def check_if_required_device_argument():
-    for x in ['-h', '--help', '-v', '--version', '-l', '--list-config-devices']:
+    for x in ['-h', '--help', '-v', '--version', '-l', '--list-config-devices', '-a', '--all']:
         if x in sys.argv:
             return False
     return True
@@ -113,6 +144,21 @@ if __name__ == "__main__":
     else:
         config = None
 
+    if len(sys.argv) > 1 and sys.argv[1] == 'query':
+        from lib.store import query_command
+        query_command(sys.argv[2:], config)
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'replay':
+        from lib.capture import replay_command
+        replay_command(sys.argv[2:])
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == 'simulate':
+        # simulated devices run through the normal startup below with a generated config
+        from lib.simulator.load_test import setup_simulation
+        sys.argv = sys.argv[:1] + setup_simulation(sys.argv[2:], config)
+
     parser = argparse.ArgumentParser(description="Victron Reader (Bluetooth, BLE and Serial) \n\n"
                                                  "Current supported devices:\n"
                                                  "  Full: \n" 
@@ -156,6 +202,13 @@ if __name__ == "__main__":
         help="Disconnect direct after getting values",
         required=False,
     )
+    group02.add_argument(
+        "--record",
+        metavar="FILE",
+        type=str,
+        help="Record the raw data of the device to a capture file, replay with: victron.py replay FILE",
+        required=False,
+    )
     group02.add_argument(
         "-v",
         "--version",
@@ -177,9 +230,18 @@ if __name__ == "__main__":
         "--device",
         metavar="NUM / NAME",
         type=str,
-        help=get_helper_string_device(config['devices']) if config is not None else "",
+        action="append",
+        help=(get_helper_string_device(config['devices']) if config is not None else "") +
+             "\nCan be given multiple times to run several devices in one process",
         required=check_if_required_device_argument(),
     )
+    group03.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help="Run all devices from loaded config in one process",
+        required=False,
+    )
     args = parser.parse_args()
 
     if args.config_file:
@@ -198,70 +260,117 @@ if __name__ == "__main__":
         print("config.yml missing. Please create or specify another config file with -C")
         sys.exit(1)
 
-    try:
-        dev_id = int(args.device)
-    except ValueError:
-        dev_id = None
-        for count, device_config in enumerate(config['devices']):
-            if device_config['name'] == args.device:
-                dev_id = count
-                break
-        if dev_id is None:
-            print(f'{args.device} not found in config')
-            sys.exit(1)
-    devices_config = config['devices'][dev_id]
-
-    logger_format = '[%(levelname)-7s] (%(asctime)s) %(filename)s::%(lineno)d %(message)s'
-    logging.basicConfig(level=logging.INFO,
-                        format=logger_format,
-                        datefmt='%Y-%m-%d %H:%M:%S',
-                        filename=f'logs/victron-{devices_config["name"]}.log')
-    logger = logging.getLogger()
-
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.INFO)
-    formatter = logging.Formatter(logger_format)
-    handler.setFormatter(formatter)
+    if args.all:
+        devices_config = config['devices']
+    else:
+        devices_config = []
+        for device in args.device:
+            try:
+                dev_id = int(device)
+            except ValueError:
+                dev_id = None
+                for count, device_config in enumerate(config['devices']):
+                    if device_config['name'] == device:
+                        dev_id = count
+                        break
+                if dev_id is None:
+                    print(f'{device} not found in config')
+                    sys.exit(1)
+            devices_config.append(config['devices'][dev_id])
+
+    if len(devices_config) == 1:
+        log_file = f'logs/victron-{devices_config[0]["name"]}.log'
+    else:
+        log_file = 'logs/victron.log'
 
     if args.debug:
-        logging.getLogger().setLevel(logging.DEBUG)
-        handler.setLevel(logging.DEBUG)
+        log_level = logging.DEBUG
     elif args.quiet:
-        logging.getLogger().setLevel(logging.ERROR)
-        handler.setLevel(logging.ERROR)
+        log_level = logging.ERROR
+    else:
+        log_level = logging.INFO
+
+    # the outputs print and json write the values to stdout, log messages would mix with them
+    from lib.log_writer import setup_logging
+    setup_logging(log_file,
+                  level=log_level,
+                  console=config['logger'] not in ('print', 'json'),
+                  log_config=config.get('log'))
+    logger = logging.getLogger()
 
     if config['logger'] == 'mqtt':
-        logger.addHandler(handler)
-
         import paho.mqtt.client as mqtt
         client = mqtt.Client()
         if "username" in config['mqtt'] and "password" in config['mqtt']:
             client.username_pw_set(username=config['mqtt']['username'],password=config['mqtt']['password'])
 
-        mqtt_lwt = f'{config["mqtt"]["base_topic"]}/{devices_config["name"]}/online'
+        # One connection can only have one last will, with several devices it is set on the base topic.
+        # No retained online topics per device then, nothing would reset them to 0 if the process dies.
+        if len(devices_config) == 1:
+            mqtt_lwt = f'{config["mqtt"]["base_topic"]}/{devices_config[0]["name"]}/online'
+        else:
+            mqtt_lwt = f'{config["mqtt"]["base_topic"]}/online'
         client.will_set(mqtt_lwt, payload=0, qos=0, retain=True)
         client.on_connect = mqtt_onconnect
+        client.on_message = mqtt_onmessage
 
         client.connect(config['mqtt']['host'], config['mqtt']['port'], 60)
         client.loop_start()
 
         output = output_mqtt
     elif config['logger'] == 'syslog':
-        logger.addHandler(handler)
+        from lib.syslog_sink import SyslogSink
+        syslog_config = config.get('syslog') or {}
+        syslog_sink = SyslogSink(syslog_config.get('address', '/dev/log'),
+                                 syslog_config.get('port', 514),
+                                 syslog_config.get('app_name', 'victron'))
         output = output_syslog
+    elif config['logger'] == 'ndjson':
+        import atexit
+        from lib.ndjson_sink import NdjsonSink
+        ndjson_config = config.get('ndjson') or {}
+        ndjson_sink = NdjsonSink(ndjson_config.get('path', 'logs/victron.ndjson'),
+                                 buffer_size=ndjson_config.get('buffer_size', 64 * 1024),
+                                 flush_interval=ndjson_config.get('flush_interval', 5),
+                                 max_bytes=ndjson_config.get('max_bytes', 10 * 1024 * 1024),
+                                 rotate_interval=ndjson_config.get('rotate_interval'),
+                                 compress=ndjson_config.get('compress', False),
+                                 backup_count=ndjson_config.get('backup_count'))
+        atexit.register(ndjson_sink.close)
+        output = output_ndjson
     elif config['logger'] == 'print':
         output = output_print
     elif config['logger'] == 'json':
         output = output_json
     else:
-        logger.addHandler(handler)
         logger.error('No output specified!')
         sys.exit(1)
 
-    q = queue.Queue()
-
-    #logger.debug("Start worker thread")
-    #t = threading.Timer(2+(1*5), victron_thread, args=(1, config, devices_config, q))
-    #t.start()
-
-    victron_thread(1, config, devices_config, q)
+    if config.get('metrics') is not None:
+        from lib.metrics import start_server
+        start_server(config['metrics'])
+
+    # systemctl stop sends SIGTERM, exit normally so the atexit hooks write what is buffered:
+    # output queue, ndjson file, store batch and log queue
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    import atexit
+    from lib.output_worker import OutputWorker, DEFAULT_CAPACITY, DEFAULT_POLICY, DEFAULT_BATCH_SIZE
+    output_queue_config = config.get('output_queue') or {}
+    q = OutputWorker(output,
+                     capacity=output_queue_config.get('capacity', DEFAULT_CAPACITY),
+                     policy=output_queue_config.get('policy', DEFAULT_POLICY),
+                     batch_size=output_queue_config.get('batch_size', DEFAULT_BATCH_SIZE))
+    q.start()
+    # publish the waiting values before exit, registered after the log writer so it still logs
+    atexit.register(q.stop)
+
+    if len(devices_config) == 1:
+        victron_thread(1, config, devices_config[0], q)
+    else:
+        from lib.supervisor import Supervisor
+        supervisor = Supervisor(devices_config,
+                                lambda thread_count, device_config: victron_thread(thread_count, config, device_config, q),
+                                config['timer']['retry'])
+        supervisor.start()
+        supervisor.join()